@@ -1,5 +1,20 @@
 from django.contrib import admin
-from .models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe
+from django.utils.html import format_html
+from .models import (
+    Run,
+    AthleteInfo,
+    Challenge,
+    Position,
+    CollectibleItem,
+    Subscribe,
+    Split,
+    BestEffort,
+    HeatmapCell,
+    CoachStats,
+    RunRollup,
+    RequestProfile,
+)
+from .profiling import SUMMARY_FILE, get_directory
 
 
 admin.site.register(Run)
@@ -8,3 +23,47 @@ admin.site.register(Challenge)
 admin.site.register(Position)
 admin.site.register(CollectibleItem)
 admin.site.register(Subscribe)
+admin.site.register(Split)
+admin.site.register(BestEffort)
+admin.site.register(HeatmapCell)
+admin.site.register(CoachStats)
+admin.site.register(RunRollup)
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = [
+        "created_at",
+        "method",
+        "path",
+        "status",
+        "duration_ms",
+        "queries",
+        "queries_ms",
+        "profiler",
+        "user",
+    ]
+    list_filter = ["profiler", "method", "route"]
+    search_fields = ["path"]
+    readonly_fields = ["files", "summary"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="files")
+    def files(self, obj):
+        directory = get_directory(obj)
+        if not directory.exists():
+            return "-"
+        paths = "\n".join(str(path) for path in sorted(directory.iterdir()))
+        return format_html("<pre>{}</pre>", paths)
+
+    @admin.display(description="summary")
+    def summary(self, obj):
+        path = get_directory(obj) / SUMMARY_FILE
+        if not path.exists():
+            return "-"
+        return format_html("<pre>{}</pre>", path.read_text())
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class AppRunConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_run'
+
+    def ready(self):
+        # connects the receivers which keep search words, coach ratings,
+        # dashboards and the nearby index up to date, count awards for the
+        # metrics and observe queries of every connection
+        from . import (  # noqa: F401
+            dashboard,
+            metrics,
+            nearby,
+            querylog,
+            ratings,
+            search,
+        )
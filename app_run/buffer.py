@@ -0,0 +1,200 @@
+"""
+Write-behind buffer of positions.
+Accepted positions wait in a per-run buffer and are written
+with one bulk_create when the buffer is full, by a background thread
+when it is old enough, when the run is stopped and when the process exits.
+Buffers live in one process: StopRunView flushes only the buffer
+of its own worker and a killed process (SIGKILL, a frozen serverless
+instance) loses what it holds, so write-behind fits one long-lived
+worker per run and should stay off on Lambda.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from functools import cache
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .live import get_broker, position_message
+from .models import Position
+from .utils import get_speed_and_distance, save_position
+
+logger = logging.getLogger(__name__)
+
+
+class RunBuffer:
+    """
+    Positions of one run waiting to be written.
+    lock guards the list and is held only to change it,
+    write_lock keeps the writes of the run in order.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.RLock()
+        # time of the oldest position
+        self.started = None
+        self.positions = []
+        # latest buffered or already written position
+        self.last = None
+
+
+class InMemoryPositionBuffer:
+    """
+    Buffer inside one process.
+    Every run has its own locks, so runs are buffered and written
+    in parallel and the database is never used under the lock of a list.
+    Old buffers are written by the flusher thread.
+    """
+
+    def __init__(self, max_size=200, max_age=2.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        # run id -> RunBuffer, the lock guards only the dict
+        self._runs = {}
+        self._runs_lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    def get_run(self, run_id):
+        with self._runs_lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                run = self._runs[run_id] = RunBuffer()
+            return run
+
+    def add(self, position):
+        """
+        Speed and distance are derived from the buffered predecessor,
+        the database is asked only for the first point of the run.
+        A retried or late fix is not buffered: the run is flushed
+        and save_position finds the stored one or chains the late one.
+        Returns the position and whether it was created.
+        """
+        run = self.get_run(position.run_id)
+        with run.lock:
+            last_position = run.last
+            if last_position is None:
+                last_position = (
+                    Position.objects.filter(run_id=position.run_id)
+                    .order_by("-date_time", "-id")
+                    .first()
+                )
+            late = (
+                last_position is not None
+                and last_position.date_time is not None
+                and position.date_time is not None
+                and position.date_time <= last_position.date_time
+            )
+            if not late:
+                position.speed, position.distance = get_speed_and_distance(
+                    last_position,
+                    position.latitude,
+                    position.longitude,
+                    position.date_time,
+                )
+                if not run.positions:
+                    run.started = time.monotonic()
+                run.positions.append(position)
+                run.last = position
+                full = len(run.positions) >= self.max_size
+
+        if late:
+            with run.write_lock:
+                self.flush(position.run_id)
+                position, created = save_position(position)
+            if created:
+                get_broker().publish(position.run_id, position_message(position))
+            return position, created
+        if full:
+            self.flush(position.run_id)
+        return position, True
+
+    def flush(self, run_id):
+        with self._runs_lock:
+            run = self._runs.get(run_id)
+        if run is None:
+            return 0
+        with run.write_lock:
+            with run.lock:
+                positions, run.positions, run.started = run.positions, [], None
+            if positions:
+                Position.objects.bulk_create(positions)
+        broker = get_broker()
+        for position in positions:
+            broker.publish(run_id, position_message(position))
+        return len(positions)
+
+    def expired(self):
+        """
+        Runs whose oldest buffered position waits longer than max_age.
+        """
+        now = time.monotonic()
+        with self._runs_lock:
+            runs = list(self._runs.items())
+        return [
+            run_id
+            for run_id, run in runs
+            if run.started is not None and now - run.started >= self.max_age
+        ]
+
+    def pending(self):
+        """
+        Runs with buffered positions.
+        """
+        with self._runs_lock:
+            runs = list(self._runs.items())
+        return [run_id for run_id, run in runs if run.positions]
+
+    def forget(self, run_id):
+        """
+        Drops everything known about the finished run.
+        """
+        with self._runs_lock:
+            self._runs.pop(run_id, None)
+
+    def flush_expired(self):
+        return sum(self.flush(run_id) for run_id in self.expired())
+
+    def flush_all(self):
+        return sum(self.flush(run_id) for run_id in self.pending())
+
+    def start_flusher(self):
+        """
+        Flushes old buffers every max_age seconds in a background thread,
+        also of runs which stopped sending.
+        """
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="position-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def stop_flusher(self):
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.max_age):
+            try:
+                self.flush_expired()
+            except Exception:
+                logger.exception("Flush of buffered positions failed")
+            finally:
+                # no connection of this thread stays open between the checks
+                connections.close_all()
+
+
+@cache
+def get_position_buffer():
+    config = settings.POSITION_BUFFER
+    buffer = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+    buffer.start_flusher()
+    # graceful shutdown of the worker writes what is left
+    atexit.register(buffer.flush_all)
+    return buffer
@@ -0,0 +1,89 @@
+"""
+Coach dashboard: every athlete of the coach with totals,
+recent finished runs, challenges and the rating given to the coach.
+A page is built with a fixed number of queries and cached,
+finishing a run or a change of the subscriptions invalidates
+every cached page of the coach.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Prefetch, Q, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Challenge, Run, StatusChoices, Subscribe
+
+FINISHED = Q(run__status=StatusChoices.FINISHED)
+
+
+def get_athletes(coach):
+    """
+    Athletes of the coach, totals are aggregated in the same query,
+    runs and challenges are two prefetch queries per page.
+    """
+    # one subscription per coach and athlete, the join does not repeat runs
+    return (
+        User.objects.filter(athlete__coach=coach)
+        .annotate(
+            rating=F("athlete__rating"),
+            runs_finished=Count("run", filter=FINISHED),
+            total_distance=Coalesce(Sum("run__distance", filter=FINISHED), 0.0),
+            total_run_time_seconds=Coalesce(
+                Sum("run__run_time_seconds", filter=FINISHED), 0
+            ),
+            best_speed=Max("run__speed", filter=FINISHED),
+        )
+        .prefetch_related(
+            Prefetch(
+                "run_set",
+                queryset=Run.objects.filter(status=StatusChoices.FINISHED).order_by(
+                    "-created_at", "-id"
+                )[: settings.COACH_DASHBOARD_RECENT_RUNS],
+                to_attr="recent_runs",
+            ),
+            Prefetch(
+                "challenge_set",
+                queryset=Challenge.objects.order_by("id"),
+                to_attr="challenges",
+            ),
+        )
+        .order_by("id")
+    )
+
+
+def version_key(coach_id):
+    return f"coach_dashboard_version:{coach_id}"
+
+
+def cache_key(coach_id, query):
+    version = cache.get_or_set(version_key(coach_id), 1, None)
+    return f"coach_dashboard:{coach_id}:{version}:{query}"
+
+
+def invalidate(*coach_ids):
+    """
+    A new version makes every cached page of the coaches stale.
+    """
+    for coach_id in coach_ids:
+        try:
+            cache.incr(version_key(coach_id))
+        except ValueError:
+            # nothing cached for the coach
+            pass
+
+
+def invalidate_athlete(athlete_id):
+    invalidate(
+        *Subscribe.objects.filter(athlete_id=athlete_id).values_list(
+            "coach_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def subscription_changed(sender, instance, **kwargs):
+    invalidate(instance.coach_id)
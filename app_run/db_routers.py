@@ -0,0 +1,82 @@
+"""
+Routing of reads to database replicas.
+"""
+
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+# True while a request which is allowed to read from a replica is handled
+use_replica = ContextVar("use_replica", default=False)
+
+
+def read_from_replica(view):
+    """
+    Marks a function view as safe to be served from a replica.
+    Class based views set read_from_replica = True instead.
+    """
+    view.read_from_replica = True
+    return view
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind the primary.
+    Backends which can not tell are considered up to date.
+    """
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+            "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+            "END"
+        )
+        return float(cursor.fetchone()[0] or 0)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to one of DATABASE_REPLICAS when the current request allows it.
+    Writes and all other reads go to default.
+    A replica which lags more than REPLICA_MAX_LAG_SECONDS or is not reachable
+    is skipped until the next check.
+    """
+
+    lag_check_interval = 10
+
+    def __init__(self):
+        # alias -> (time of the check, replica is usable)
+        self._health = {}
+
+    def db_for_read(self, model, **hints):
+        if not use_replica.get():
+            return "default"
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS if self.is_healthy(alias)
+        ]
+        return random.choice(replicas) if replicas else "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+    def is_healthy(self, alias):
+        checked_at, healthy = self._health.get(alias, (None, False))
+        now = time.monotonic()
+        if checked_at is None or now - checked_at > self.lag_check_interval:
+            try:
+                healthy = replica_lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+            except Exception:
+                healthy = False
+            self._health[alias] = (now, healthy)
+        return healthy
@@ -0,0 +1,66 @@
+"""
+Shared geodesic distance with a bounded LRU cache.
+validate_latitude and validate_longitude allow only 4 decimals,
+so positions and collectible items lie on a grid and stationary or
+looping runners measure the same pairs of points again and again.
+"""
+
+from functools import lru_cache
+
+from django.conf import settings
+
+GRID = 10_000
+
+
+def geodesic_m(point1, point2):
+    # geopy is imported on the first measurement, not at startup
+    from geopy.distance import geodesic
+
+    return geodesic(point1, point2).meters
+
+
+def _on_grid(point):
+    latitude, longitude = point
+    return round(latitude, 4) == latitude and round(longitude, 4) == longitude
+
+
+@lru_cache(maxsize=settings.GEODESIC_CACHE_SIZE)
+def _grid_distance_m(latitude1, longitude1, latitude2, longitude2):
+    return geodesic_m(
+        (latitude1 / GRID, longitude1 / GRID), (latitude2 / GRID, longitude2 / GRID)
+    )
+
+
+def distance_m(point1, point2):
+    """
+    Geodesic distance in meters between two (latitude, longitude) points.
+    Points with more than 4 decimals are measured without the cache.
+    """
+    if not (_on_grid(point1) and _on_grid(point2)):
+        return geodesic_m(point1, point2)
+    key1 = (round(point1[0] * GRID), round(point1[1] * GRID))
+    key2 = (round(point2[0] * GRID), round(point2[1] * GRID))
+    # distance is symmetric, one entry serves both directions
+    if key1 > key2:
+        key1, key2 = key2, key1
+    return _grid_distance_m(*key1, *key2)
+
+
+def distance_km(point1, point2):
+    return distance_m(point1, point2) / 1000
+
+
+def cache_info():
+    info = _grid_distance_m.cache_info()
+    requests = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_rate": round(info.hits / requests, 4) if requests else 0,
+    }
+
+
+def cache_clear():
+    _grid_distance_m.cache_clear()
@@ -0,0 +1,41 @@
+"""
+Database functions which Django does not provide for every backend.
+"""
+
+from django.db.models import FloatField, Func
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+
+class Epoch(Func):
+    """
+    Seconds since 1970-01-01 UTC with the fractional part.
+    """
+
+    function = "EXTRACT"
+    template = "EXTRACT(EPOCH FROM %(expressions)s)"
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # whole seconds are exact, milliseconds come from the %f field
+        sql, params = compiler.compile(self.source_expressions[0])
+        return (
+            f"(CAST(strftime('%%s', {sql}) AS REAL)"
+            f" + strftime('%%f', {sql}) - strftime('%%S', {sql}))",
+            params * 3,
+        )
+
+
+# Mean Earth radius (IUGG), the geodesic ellipsoid differs by up to 0.5%
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great circle distance in km between two points as an ORM expression.
+    """
+    half_dlat = Radians(latitude2 - latitude1) / 2
+    half_dlon = Radians(longitude2 - longitude1) / 2
+    a = Power(Sin(half_dlat), 2) + Cos(Radians(latitude1)) * Cos(
+        Radians(latitude2)
+    ) * Power(Sin(half_dlon), 2)
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a))
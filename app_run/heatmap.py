@@ -0,0 +1,74 @@
+"""
+Heatmap of all positions, pre-aggregated per Web Mercator tile.
+"""
+
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .metrics import count_cache
+from .models import HeatmapCell, Position
+
+# Web Mercator is defined up to this latitude
+MAX_LATITUDE = 85.05112878
+
+
+def get_cell(latitude, longitude, zoom):
+    """
+    x and y of the slippy map tile which contains the point.
+    """
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    tiles = 2**zoom
+    x = int((longitude + 180) / 360 * tiles)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * tiles)
+    return min(x, tiles - 1), min(y, tiles - 1)
+
+
+def add_run(run):
+    """
+    Adds positions of the run to every zoom level of the heatmap.
+    Counts are incremented by the database, concurrent runs do not
+    overwrite each other.
+    """
+    counts = Counter()
+    for latitude, longitude in Position.objects.filter(run=run).values_list(
+        "latitude", "longitude"
+    ):
+        for zoom in settings.HEATMAP_ZOOM_LEVELS:
+            counts[(zoom, *get_cell(latitude, longitude, zoom))] += 1
+    if not counts:
+        return
+    table = connection.ops.quote_name(HeatmapCell._meta.db_table)
+    count = connection.ops.quote_name("count")
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (zoom, x, y, {count}) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT (zoom, x, y) "
+            f"DO UPDATE SET {count} = {table}.{count} + EXCLUDED.{count}",
+            [(*cell, value) for cell, value in counts.items()],
+        )
+
+
+def get_cells(zoom, min_longitude, min_latitude, max_longitude, max_latitude):
+    """
+    Cells of the zoom level inside the bounding box, served from cache.
+    Returns None when the box holds more than HEATMAP_MAX_CELLS cells.
+    """
+    min_x, max_y = get_cell(min_latitude, min_longitude, zoom)
+    max_x, min_y = get_cell(max_latitude, max_longitude, zoom)
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > settings.HEATMAP_MAX_CELLS:
+        return None
+    key = f"heatmap:{zoom}:{min_x}:{min_y}:{max_x}:{max_y}"
+    cells = cache.get(key)
+    count_cache("heatmap", cells is not None)
+    if cells is None:
+        cells = list(
+            HeatmapCell.objects.filter(
+                zoom=zoom, x__range=(min_x, max_x), y__range=(min_y, max_y)
+            ).values("x", "y", "count")
+        )
+        cache.set(key, cells, settings.HEATMAP_CACHE_SECONDS)
+    return cells
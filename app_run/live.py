@@ -0,0 +1,170 @@
+"""
+Live run tracking.
+Accepted positions are published to a broker, Server-Sent Events
+subscribers receive only the points they have not seen yet.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+from functools import cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import Position, Run, StatusChoices
+from .renderers import dumps
+from .serializers import PositionSerializer
+
+POSITION = "position"
+FINISHED = "finished"
+
+
+def position_message(position):
+    return {
+        "id": position.id,
+        "event": POSITION,
+        "data": dict(PositionSerializer(position).data),
+    }
+
+
+def finished_message():
+    return {"id": None, "event": FINISHED, "data": {"status": StatusChoices.FINISHED}}
+
+
+def format_event(message):
+    """
+    Formats a message as a Server-Sent Event.
+    None means there was nothing new, a comment keeps the connection alive.
+    """
+    if message is None:
+        return ": keepalive\n\n"
+    lines = []
+    if message["id"] is not None:
+        lines.append(f"id: {message['id']}")
+    lines.append(f"event: {message['event']}")
+    lines.append(f"data: {dumps(message['data']).decode()}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def fetch_positions(run_id, last_id):
+    positions = Position.objects.filter(run_id=run_id, id__gt=last_id).order_by("id")
+    return [position_message(position) async for position in positions]
+
+
+async def is_finished(run_id):
+    # a run which is not started yet is waited for like a running one
+    return await Run.objects.filter(id=run_id, status=StatusChoices.FINISHED).aexists()
+
+
+class BaseBroker:
+    """
+    Interface of the live tracking backend.
+    publish is called from sync views, listen is an async generator
+    which yields messages with id greater than last_id,
+    None after keepalive seconds without news
+    and a finished message at the end of the run.
+    """
+
+    def __init__(self, keepalive=15):
+        self.keepalive = keepalive
+
+    def publish(self, run_id, message):
+        raise NotImplementedError
+
+    def listen(self, run_id, last_id):
+        raise NotImplementedError
+
+
+class InMemoryBroker(BaseBroker):
+    """
+    Fan-out inside one process.
+    Every listener has its own queue bound to its event loop,
+    so publish is safe to call from any thread.
+    """
+
+    def __init__(self, keepalive=15):
+        super().__init__(keepalive)
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, run_id, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(run_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # event loop of the listener is already closed
+                pass
+
+    async def listen(self, run_id, last_id):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[run_id].add(subscriber)
+        try:
+            # subscribe first and catch up afterwards, so no point is lost
+            finished = await is_finished(run_id)
+            for message in await fetch_positions(run_id, last_id):
+                last_id = message["id"]
+                yield message
+            if finished:
+                yield finished_message()
+                return
+
+            queue = subscriber[1]
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.keepalive)
+                except TimeoutError:
+                    yield None
+                    continue
+                if message["event"] == FINISHED:
+                    yield message
+                    return
+                if message["id"] > last_id:
+                    last_id = message["id"]
+                    yield message
+        finally:
+            with self._lock:
+                self._subscribers[run_id].discard(subscriber)
+                if not self._subscribers[run_id]:
+                    del self._subscribers[run_id]
+
+
+class DatabaseBroker(BaseBroker):
+    """
+    Backend for several workers.
+    Positions are already committed, so publish does nothing
+    and every listener polls the positions table.
+    """
+
+    def __init__(self, keepalive=15, poll_interval=1):
+        super().__init__(keepalive)
+        self.poll_interval = poll_interval
+
+    def publish(self, run_id, message):
+        pass
+
+    async def listen(self, run_id, last_id):
+        idle = 0
+        while True:
+            finished = await is_finished(run_id)
+            messages = await fetch_positions(run_id, last_id)
+            for message in messages:
+                last_id = message["id"]
+                yield message
+            if finished:
+                yield finished_message()
+                return
+            idle = 0 if messages else idle + self.poll_interval
+            if idle >= self.keepalive:
+                idle = 0
+                yield None
+            await asyncio.sleep(self.poll_interval)
+
+
+@cache
+def get_broker():
+    config = settings.LIVE_TRACKING
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
@@ -0,0 +1,72 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from app_run.distance import cache_clear, cache_info, distance_m
+
+
+class Command(BaseCommand):
+    """
+    Measures consecutive distances of generated tracks with plain geodesic
+    and with the cached distance service.
+    python manage.py bench_geodesic --settings=project_run.settings.local
+    """
+
+    help = "Benchmark cached geodesic distance"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        points = options["points"]
+        random.seed(30)
+        for name, track in (
+            ("straight run", self.straight(points)),
+            ("stadium laps", self.laps(points)),
+            ("stops at lights", self.stops(points)),
+        ):
+            pairs = list(zip(track, track[1:]))
+            started = time.perf_counter()
+            for start, finish in pairs:
+                geodesic(start, finish).meters
+            plain = time.perf_counter() - started
+
+            cache_clear()
+            started = time.perf_counter()
+            for start, finish in pairs:
+                distance_m(start, finish)
+            cached = time.perf_counter() - started
+            self.stdout.write(
+                f"{name}: geodesic {plain:.2f}s, cached {cached:.2f}s, "
+                f"x{plain / cached:.1f}, hit rate {cache_info()['hit_rate']:.0%}"
+            )
+
+    def point(self, latitude, longitude):
+        return round(latitude, 4), round(longitude, 4)
+
+    def straight(self, count):
+        # 1 Hz fixes at ~3 m/s never repeat
+        return [self.point(55.75 + i * 0.00003, 37.61) for i in range(count)]
+
+    def laps(self, count):
+        # 400 m stadium, GPS snaps to the same grid cells every lap
+        return [
+            self.point(
+                55.75 + 0.0006 * math.sin(i / 40), 37.61 + 0.001 * math.cos(i / 40)
+            )
+            for i in range(count)
+        ]
+
+    def stops(self, count):
+        # a runner standing still at traffic lights half of the time
+        track = []
+        latitude = 55.75
+        while len(track) < count:
+            for _ in range(30):
+                latitude += 0.00003
+                track.append(self.point(latitude, 37.61))
+            track.extend([self.point(latitude, 37.61)] * 30)
+        return track[:count]
@@ -0,0 +1,98 @@
+import io
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from app_run.models import Position, Run, StatusChoices
+from app_run.parsers import ORJSONParser
+from app_run.renderers import ORJSONRenderer
+from app_run.views import PositionViewSet, UserViewSet
+
+
+class Command(BaseCommand):
+    """
+    Compares stdlib json and orjson on /api/positions/ and /api/users/.
+    Both views are called with the same queryset, only renderer differs.
+    Run it against a local database:
+    python manage.py bench_json --settings=project_run.settings.local
+    """
+
+    help = "Benchmark JSON renderers and parsers"
+    prefix = "bench_json_"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--positions", type=int, default=5000)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        User.objects.filter(username__startswith=self.prefix).delete()
+        run = self.create_data(options["positions"], options["users"])
+        factory = APIRequestFactory()
+        try:
+            for name, viewset, url in (
+                ("/api/positions/", PositionViewSet, f"/api/positions/?run={run.id}"),
+                ("/api/users/", UserViewSet, "/api/users/"),
+            ):
+                results = {}
+                for renderer in (JSONRenderer, ORJSONRenderer):
+                    view = viewset.as_view({"get": "list"}, renderer_classes=[renderer])
+                    results[renderer] = self.measure(
+                        lambda: view(factory.get(url)).render(), options["repeat"]
+                    )
+                self.report(name, results[JSONRenderer], results[ORJSONRenderer])
+
+            content = view(factory.get("/api/users/")).render().content
+            results = {}
+            for parser in (JSONParser, ORJSONParser):
+                results[parser] = self.measure(
+                    lambda: parser().parse(io.BytesIO(content)), options["repeat"]
+                )
+            self.report("parse users", results[JSONParser], results[ORJSONParser])
+        finally:
+            User.objects.filter(username__startswith=self.prefix).delete()
+
+    def create_data(self, positions, users):
+        User.objects.bulk_create(
+            User(
+                username=f"{self.prefix}{index}",
+                first_name="Ёжик",
+                last_name=f"Туманов {index}",
+            )
+            for index in range(users)
+        )
+        athlete = User.objects.get(username=f"{self.prefix}0")
+        run = Run.objects.create(athlete=athlete, status=StatusChoices.IN_PROGRESS)
+        start = datetime(2025, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
+        Position.objects.bulk_create(
+            Position(
+                run=run,
+                latitude=round(55.75 + index * 0.0001, 4),
+                longitude=37.61,
+                date_time=start + timedelta(seconds=index),
+                speed=3.5,
+                distance=round(index * 0.01, 2),
+            )
+            for index in range(positions)
+        )
+        return run
+
+    def measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def report(self, name, stdlib, fast):
+        self.stdout.write(
+            f"{name}: json {stdlib * 1000:.1f} ms, orjson {fast * 1000:.1f} ms, "
+            f"x{stdlib / fast:.2f}"
+        )
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+
+from app_run.models import Run, StatusChoices
+from app_run.views import wait_side_effects
+
+
+class Command(BaseCommand):
+    """
+    Compares the sync PositionViewSet with the async ingest endpoint.
+    Every runner posts its fixes one by one, runners work concurrently
+    only on the async endpoint.
+    Run it against a local database:
+    python manage.py bench_position_ingest --settings=project_run.settings.local
+    """
+
+    help = "Benchmark sync and async position ingest"
+    username = "bench_position_ingest"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runners", type=int, default=20)
+        parser.add_argument("--positions", type=int, default=20)
+
+    def handle(self, *args, **options):
+        runners, positions = options["runners"], options["positions"]
+        User.objects.filter(username=self.username).delete()
+        athlete = User.objects.create_user(username=self.username)
+        try:
+            sync_runs = self.create_runs(athlete, runners)
+            started = time.perf_counter()
+            client = Client()
+            for run in sync_runs:
+                for payload in self.payloads(run, positions):
+                    response = client.post(
+                        "/api/positions/", payload, content_type="application/json"
+                    )
+                    assert response.status_code == 201, response.content
+            self.report("sync  /api/positions/", runners * positions, started)
+
+            async_runs = self.create_runs(athlete, runners)
+            started = time.perf_counter()
+            asyncio.run(self.post_async(async_runs, positions))
+            self.report("async /api/positions/ingest/", runners * positions, started)
+        finally:
+            athlete.delete()
+
+    def create_runs(self, athlete, count):
+        return Run.objects.bulk_create(
+            Run(athlete=athlete, status=StatusChoices.IN_PROGRESS) for _ in range(count)
+        )
+
+    def payloads(self, run, count):
+        start = datetime(2025, 1, 1, 10, 0, 0)
+        for index in range(count):
+            yield {
+                "run": run.id,
+                "latitude": round(55.75 + index * 0.0001, 4),
+                "longitude": 37.61,
+                "date_time": (start + timedelta(seconds=index)).isoformat(),
+            }
+
+    async def post_async(self, runs, positions):
+        client = AsyncClient()
+
+        async def runner(run):
+            for payload in self.payloads(run, positions):
+                response = await client.post(
+                    "/api/positions/ingest/", payload, content_type="application/json"
+                )
+                assert response.status_code == 201, response.content
+
+        await asyncio.gather(*(runner(run) for run in runs))
+        await wait_side_effects()
+
+    def report(self, name, requests, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{name}: {requests} requests in {elapsed:.2f}s, "
+            f"{requests / elapsed:.0f} req/s"
+        )
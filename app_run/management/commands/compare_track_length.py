@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from app_run.models import Run
+from app_run.views import StopRunView
+
+
+def track_km(track):
+    return sum(segment for _, _, segment in track)
+
+
+class Command(BaseCommand):
+    """
+    Compares track length of geodesic (python) and haversine (database)
+    calculations on the latest runs. Nothing is saved.
+    python manage.py compare_track_length --runs 100 --settings=project_run.settings.local
+    """
+
+    help = "Compare geodesic and database track length"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=100)
+
+    def handle(self, *args, **options):
+        runs = (
+            Run.objects.annotate(points=Count("position"))
+            .filter(points__gt=1)
+            .order_by("-id")[: options["runs"]]
+        )
+        view = StopRunView()
+        errors = []
+        timings = {"python": 0, "database": 0}
+        for run in runs:
+            started = time.perf_counter()
+            geodesic_km = track_km(view.get_geodesic_track(run))
+            timings["python"] += time.perf_counter() - started
+            started = time.perf_counter()
+            database_km = track_km(view.get_track_in_database(run))
+            timings["database"] += time.perf_counter() - started
+            if geodesic_km:
+                errors.append(abs(database_km - geodesic_km) / geodesic_km)
+
+        if not errors:
+            self.stdout.write("No runs with a track")
+            return
+        self.stdout.write(
+            f"{len(errors)} runs: max error {max(errors):.4%}, "
+            f"mean error {sum(errors) / len(errors):.4%}, "
+            f"python {timings['python']:.2f}s, database {timings['database']:.2f}s"
+        )
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def profile_imports(module="project_run.urls"):
+    """
+    Imports the module after django.setup() in a fresh interpreter
+    with -X importtime.
+    Returns (module name, self microseconds, cumulative microseconds) of
+    every imported module.
+    """
+    code = f"import django; django.setup(); import {module}"
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+class Command(BaseCommand):
+    """
+    Import-time breakdown of a cold start: django.setup() and the URLconf,
+    grouped by top level package.
+    python manage.py import_profile --top 15 --settings=project_run.settings.local
+    """
+
+    help = "Show where the import time of a cold start goes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--module", default="project_run.urls")
+        parser.add_argument("--top", type=int, default=15)
+
+    def handle(self, *args, **options):
+        imports = profile_imports(options["module"])
+        packages = defaultdict(int)
+        for name, self_us, _ in imports:
+            packages[name.split(".")[0]] += self_us
+
+        total_ms = sum(packages.values()) / 1000
+        self.stdout.write(f"{len(imports)} modules imported in {total_ms:.1f} ms")
+        top = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+        for package, self_us in top[: options["top"]]:
+            self.stdout.write(f"{self_us / 1000:10.1f} ms  {package}")
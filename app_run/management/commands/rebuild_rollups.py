@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from app_run import rollups
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds weekly and monthly rollups from finished runs,
+    e.g. after runs were recomputed or deleted.
+    python manage.py rebuild_rollups --athlete 1 --athlete 2 --settings=project_run.settings.local
+    """
+
+    help = "Rebuild weekly and monthly run rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--athlete",
+            type=int,
+            action="append",
+            help="Only this athlete, can be repeated. All athletes by default.",
+        )
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild(options["athlete"])
+        self.stdout.write(f"{count} rollups rebuilt")
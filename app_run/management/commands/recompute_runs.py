@@ -0,0 +1,182 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from app_run.distance import distance_m
+from app_run.models import Position, Run, StatusChoices
+from app_run.utils import get_speed_and_distance_for_meters
+from app_run.views import StopRunView
+
+
+def init_worker():
+    # needed when processes are spawned instead of forked
+    django.setup()
+
+
+def recompute_run(run, chunk_size):
+    """
+    Streams positions of the run in time order, rebuilds the speed and
+    distance chain of every position and the totals of a finished run.
+    Returns the number of positions.
+    """
+    positions = (
+        Position.objects.filter(run=run, date_time__isnull=False)
+        .order_by("date_time", "id")
+        .only("id", "latitude", "longitude", "date_time")
+        .iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    total_m = 0
+    speed_sum = 0
+    first = last = None
+    changed = []
+    # the track of StopRunView.get_track for the splits
+    track = []
+    for position in positions:
+        meters = 0
+        if last is None:
+            first = position
+            position.speed, position.distance = 0, 0
+        else:
+            meters = distance_m(
+                (last.latitude, last.longitude), (position.latitude, position.longitude)
+            )
+            total_m += meters
+            position.speed, position.distance = get_speed_and_distance_for_meters(
+                last, meters, position.date_time
+            )
+        track.append((position.date_time, position.speed, meters / 1000))
+        count += 1
+        speed_sum += position.speed
+        changed.append(position)
+        if len(changed) >= chunk_size:
+            Position.objects.bulk_update(changed, ["speed", "distance"])
+            changed = []
+        last = position
+    Position.objects.bulk_update(changed, ["speed", "distance"])
+
+    if run.status == StatusChoices.FINISHED:
+        # same totals as StopRunView.get_total_km
+        if count > 1:
+            run.distance = round(total_m / 1000, 3)
+            run.run_time_seconds = round(
+                (last.date_time - first.date_time).total_seconds()
+            )
+            run.speed = round(speed_sum / count, 2)
+        else:
+            run.distance, run.run_time_seconds, run.speed = 0, 0, 0
+        run.save(update_fields=["distance", "run_time_seconds", "speed"])
+        StopRunView().save_splits(run, track)
+    return count
+
+
+def recompute_shard(first_id, last_id, chunk_size):
+    """
+    Recomputes runs with first_id <= id < last_id.
+    Returns the number of runs and positions.
+    """
+    runs = Run.objects.filter(id__gte=first_id, id__lt=last_id).select_related(
+        "athlete"
+    )
+    runs_count = positions_count = 0
+    for run in runs:
+        with transaction.atomic():
+            positions_count += recompute_run(run, chunk_size)
+        runs_count += 1
+    return runs_count, positions_count
+
+
+class Command(BaseCommand):
+    """
+    Recomputes Run.distance, run_time_seconds, speed and speed/distance
+    of every position after a change of the distance logic.
+    Runs are split into shards by id, shards are processed by a pool of
+    processes, finished shards are written to the checkpoint file,
+    so an interrupted recompute continues where it stopped.
+    python manage.py recompute_runs --workers 8 --settings=project_run.settings.local
+    """
+
+    help = "Recompute metrics of runs and positions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--shard-size", type=int, default=1000)
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--checkpoint", default="recompute_runs.json")
+        parser.add_argument(
+            "--reset", action="store_true", help="Ignore the existing checkpoint"
+        )
+
+    def handle(self, *args, **options):
+        shard_size = options["shard_size"]
+        checkpoint = Path(options["checkpoint"])
+        done = self.load_checkpoint(checkpoint, shard_size, options["reset"])
+
+        bounds = Run.objects.aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            self.stdout.write("No runs to recompute")
+            return
+        shards = [
+            (first_id, min(first_id + shard_size, bounds["last"] + 1))
+            for first_id in range(bounds["first"], bounds["last"] + 1, shard_size)
+        ]
+        todo = [shard for shard in shards if list(shard) not in done]
+        self.stdout.write(f"{len(todo)} of {len(shards)} shards to recompute")
+
+        workers = options["workers"]
+        if workers > 1 and connections["default"].vendor == "sqlite":
+            self.stdout.write("SQLite allows one writer at a time, using 1 worker")
+            workers = 1
+
+        self.started = time.perf_counter()
+        self.runs = self.positions = 0
+        args = [(*shard, options["chunk_size"]) for shard in todo]
+        if workers <= 1:
+            for shard_args in args:
+                result = recompute_shard(*shard_args)
+                self.shard_done(shard_args[:2], result, done, checkpoint, shard_size)
+        else:
+            # children must not share connections of the parent
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+                futures = {
+                    pool.submit(recompute_shard, *shard_args): shard_args[:2]
+                    for shard_args in args
+                }
+                for future in as_completed(futures):
+                    self.shard_done(
+                        futures[future], future.result(), done, checkpoint, shard_size
+                    )
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(done)} of {len(shards)} shards recomputed")
+        )
+
+    def load_checkpoint(self, checkpoint, shard_size, reset):
+        if reset or not checkpoint.exists():
+            return []
+        state = json.loads(checkpoint.read_text())
+        if state["shard_size"] != shard_size:
+            raise CommandError(
+                f"Checkpoint was made with --shard-size {state['shard_size']}, "
+                "use the same size or --reset"
+            )
+        return state["done"]
+
+    def shard_done(self, shard, result, done, checkpoint, shard_size):
+        done.append(list(shard))
+        checkpoint.write_text(json.dumps({"shard_size": shard_size, "done": done}))
+        runs, positions = result
+        self.runs += runs
+        self.positions += positions
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(
+            f"shard {shard[0]}-{shard[1] - 1}: {self.runs} runs, "
+            f"{self.positions} positions, {self.positions / elapsed:.0f} positions/s"
+        )
@@ -0,0 +1,101 @@
+"""
+Operational metrics in the Prometheus text format.
+With PROMETHEUS_MULTIPROC_DIR set in the environment every worker
+writes its values to files in that directory and /api/metrics/
+sums the values of all workers. Only counters and histograms are used,
+they need no aggregation mode.
+"""
+
+import os
+import threading
+
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+from .distance import cache_info
+from .models import Challenge, CollectibleItem
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent on a request",
+    ["method", "route", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries executed by a request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, float("inf")),
+)
+POSITIONS_INGESTED = Counter(
+    "positions_ingested_total", "Accepted positions", ["endpoint"]
+)
+RUNS_FINISHED = Counter("runs_finished_total", "Finished runs")
+COLLECTIBLE_AWARDS = Counter(
+    "collectible_awards_total", "Collectible items given to athletes", ["source"]
+)
+CHALLENGE_AWARDS = Counter("challenge_awards_total", "Challenges given to athletes")
+XLSX_ROWS = Counter(
+    "xlsx_rows_imported_total", "Rows of uploaded collectible items", ["result"]
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+
+# geodesic cache counters of this process already added to CACHE_REQUESTS,
+# the lock keeps concurrent scrapes from adding the same growth twice
+_distance_cache_seen = {"hits": 0, "misses": 0}
+_distance_cache_lock = threading.Lock()
+
+
+def count_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_distance_cache():
+    """
+    The geodesic lru_cache counts by itself,
+    its growth since the last call is added to the counters.
+    """
+    with _distance_cache_lock:
+        info = cache_info()
+        for key, result in (("hits", "hit"), ("misses", "miss")):
+            # the cache may have been cleared in between
+            added = info[key] - _distance_cache_seen[key]
+            if added < 0:
+                added = info[key]
+            if added:
+                CACHE_REQUESTS.labels("geodesic", result).inc(added)
+            _distance_cache_seen[key] = info[key]
+
+
+def exposition():
+    """
+    Metrics of all workers in the text format and its content type.
+    """
+    record_distance_cache()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+@receiver(post_save, sender=Challenge)
+def challenge_saved(sender, created, **kwargs):
+    if created:
+        CHALLENGE_AWARDS.inc()
+
+
+@receiver(m2m_changed, sender=CollectibleItem.users.through)
+def items_added(sender, action, pk_set, **kwargs):
+    # pk_set holds only the pairs which were not there before
+    if action == "post_add" and pk_set:
+        COLLECTIBLE_AWARDS.labels("position").inc(len(pk_set))
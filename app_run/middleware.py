@@ -0,0 +1,142 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from rest_framework.permissions import SAFE_METHODS
+from django.conf import settings
+
+from .db_routers import use_replica
+from .metrics import REQUEST_LATENCY, REQUEST_QUERIES, record_distance_cache
+from .profiling import aget_profiler, aprofile_request, get_profiler, profile_request
+from .querylog import collect
+
+
+class BaseMiddleware:
+    """
+    Middleware for sync and async chains, so Django does not adapt
+    an ASGI request to a thread. Subclasses implement call and acall.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.acall(request)
+        return self.call(request)
+
+    def call(self, request):
+        raise NotImplementedError
+
+    async def acall(self, request):
+        raise NotImplementedError
+
+
+class ReplicaRoutingMiddleware(BaseMiddleware):
+    """
+    Allows reads from replicas for safe requests to views marked
+    with read_from_replica.
+    After an unsafe request the client is pinned to the primary
+    for REPLICA_PIN_SECONDS, so it always reads its own writes.
+    """
+
+    cookie_name = "primary_pin"
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(self):
+            # an async chain awaits it without a thread
+            self.process_view = self.aprocess_view
+
+    def call(self, request):
+        use_replica.set(False)
+        return self.process_response(request, self.get_response(request))
+
+    async def acall(self, request):
+        use_replica.set(False)
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                self.cookie_name,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.route_view(request, view_func)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.route_view(request, view_func)
+
+    def route_view(self, request, view_func):
+        # DRF views keep their class in cls, Django views in view_class
+        view_class = getattr(view_func, "cls", getattr(view_func, "view_class", None))
+        marked = getattr(view_func, "read_from_replica", False) or getattr(
+            view_class, "read_from_replica", False
+        )
+        if (
+            marked
+            and request.method in SAFE_METHODS
+            and self.cookie_name not in request.COOKIES
+        ):
+            use_replica.set(True)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Records latency and the number of database queries of every request
+    per route, the pattern of the URL and not the URL itself.
+    """
+
+    def call(self, request):
+        queries = []
+        started = time.perf_counter()
+        with collect(lambda *query: queries.append(None)):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, len(queries))
+        return response
+
+    async def acall(self, request):
+        queries = []
+        started = time.perf_counter()
+        with collect(lambda *query: queries.append(None)):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, len(queries))
+        return response
+
+    def record(self, request, response, elapsed, queries):
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(
+            elapsed
+        )
+        REQUEST_QUERIES.labels(request.method, route).observe(queries)
+        record_distance_cache()
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    """
+    Runs the request under a profiler when a staff user asks for it,
+    see app_run.profiling. Must follow AuthenticationMiddleware.
+    """
+
+    def call(self, request):
+        profiler = get_profiler(request)
+        if profiler is None:
+            return self.get_response(request)
+        return profile_request(request, self.get_response, profiler)
+
+    async def acall(self, request):
+        profiler = await aget_profiler(request)
+        if profiler is None:
+            return await self.get_response(request)
+        return await aprofile_request(request, self.get_response, profiler)
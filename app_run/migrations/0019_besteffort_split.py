@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-19 10:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0018_subscribe_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestEffort',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.PositiveSmallIntegerField(choices=[(1, 'Km 1'), (5, 'Km 5'), (10, 'Km 10')])),
+                ('seconds', models.FloatField()),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_efforts', to='app_run.run')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['athlete', 'distance', 'seconds'], name='app_run_bes_athlete_92c180_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Split',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('km', models.PositiveSmallIntegerField()),
+                ('seconds', models.FloatField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='splits', to='app_run.run')),
+            ],
+            options={
+                'ordering': ['km'],
+                'constraints': [models.UniqueConstraint(fields=('run', 'km'), name='unique_run_split')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2 on 2026-10-19 10:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    # the earliest subscription of a pair is kept
+    Subscribe = apps.get_model('app_run', 'Subscribe')
+    pairs = (
+        Subscribe.objects.values('coach', 'athlete')
+        .annotate(first=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for pair in pairs:
+        Subscribe.objects.filter(coach=pair['coach'], athlete=pair['athlete']).exclude(
+            id=pair['first']
+        ).delete()
+
+
+def fill_coach_stats(apps, schema_editor):
+    Subscribe = apps.get_model('app_run', 'Subscribe')
+    CoachStats = apps.get_model('app_run', 'CoachStats')
+    stats = (
+        Subscribe.objects.filter(rating__isnull=False)
+        .values('coach')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('id'))
+    )
+    CoachStats.objects.bulk_create(
+        CoachStats(
+            coach_id=row['coach'],
+            rating_sum=row['rating_sum'],
+            rating_count=row['rating_count'],
+        )
+        for row in stats
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0021_position_app_run_pos_run_id_c8a227_idx'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoachStats',
+            fields=[
+                ('coach', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='coach_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+        migrations.RunPython(fill_coach_stats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscribe',
+            constraint=models.UniqueConstraint(fields=('coach', 'athlete'), name='unique_subscription'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-19 10:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_search_words(apps, schema_editor):
+    # same normalization as app_run.search.normalize
+    User = apps.get_model('auth', 'User')
+    UserSearchWord = apps.get_model('app_run', 'UserSearchWord')
+    words = []
+    users = User.objects.values_list('id', 'first_name', 'last_name')
+    for user_id, first_name, last_name in users.iterator(chunk_size=10000):
+        name = f'{first_name} {last_name}'.casefold().replace('ё', 'е')
+        words.extend(UserSearchWord(user_id=user_id, word=word) for word in set(name.split()))
+        if len(words) >= 10000:
+            UserSearchWord.objects.bulk_create(words)
+            words = []
+    UserSearchWord.objects.bulk_create(words)
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX app_run_usersearchword_word_trgm '
+        'ON app_run_usersearchword USING gin (word gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS app_run_usersearchword_word_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0022_coachstats_subscribe_unique_subscription'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(db_index=True, max_length=150)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_words', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_search_words, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
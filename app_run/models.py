@@ -91,6 +91,9 @@ class Position(models.Model):
         blank=True,
     )
 
+    class Meta:
+        indexes = [models.Index(fields=["run", "date_time"])]
+
     def __str__(self):
         return f"{self.run}"
 
@@ -125,5 +128,182 @@ class Subscribe(models.Model):
     athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name="athlete")
     rating = models.SmallIntegerField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["coach", "athlete"], name="unique_subscription"
+            )
+        ]
+
     def __str__(self):
         return str(f"{self.athlete.last_name} подписан на {self.coach.last_name}")
+
+
+class CoachStats(models.Model):
+    """
+    Sum and number of ratings of the coach,
+    kept up to date by every rating change.
+    """
+
+    coach = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="coach_stats"
+    )
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.coach} {self.rating_sum}/{self.rating_count}"
+
+
+class EffortChoices(models.IntegerChoices):
+    """
+    Distances of best efforts in km
+    """
+
+    KM_1 = 1
+    KM_5 = 5
+    KM_10 = 10
+
+
+class Split(models.Model):
+    """
+    Time of every full kilometre of the finished run
+    """
+
+    run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name="splits")
+    km = models.PositiveSmallIntegerField()
+    seconds = models.FloatField()
+
+    class Meta:
+        ordering = ["km"]
+        constraints = [
+            models.UniqueConstraint(fields=["run", "km"], name="unique_run_split")
+        ]
+
+    def __str__(self):
+        return f"{self.run} {self.km} km"
+
+
+class BestEffort(models.Model):
+    """
+    Fastest segment of 1, 5 or 10 km inside the finished run
+    """
+
+    run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name="best_efforts")
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE)
+    distance = models.PositiveSmallIntegerField(choices=EffortChoices.choices)
+    seconds = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["athlete", "distance", "seconds"])]
+
+    def __str__(self):
+        return f"{self.athlete} {self.distance} km"
+
+
+class HeatmapCell(models.Model):
+    """
+    Number of positions inside a Web Mercator tile of the given zoom.
+    Counts are added when a run is finished.
+    """
+
+    zoom = models.PositiveSmallIntegerField()
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["zoom", "x", "y"], name="unique_heatmap_cell"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.zoom}/{self.x}/{self.y}"
+
+
+class UserSearchWord(models.Model):
+    """
+    Normalized words of the first and last name of the user.
+    Searched by prefix, PostgreSQL also gets a trigram index
+    created by the migration.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="search_words"
+    )
+    word = models.CharField(max_length=150, db_index=True)
+
+    def __str__(self):
+        return self.word
+
+
+class PeriodChoices(models.TextChoices):
+    """
+    Periods of the run rollups
+    """
+
+    WEEK = "week"
+    MONTH = "month"
+
+
+class RunRollup(models.Model):
+    """
+    Finished runs of the athlete summed per week and per month.
+    start is the Monday of the week or the first day of the month.
+    """
+
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name="rollups")
+    period = models.CharField(max_length=5, choices=PeriodChoices.choices)
+    start = models.DateField()
+    runs = models.PositiveIntegerField(default=0)
+    distance = models.FloatField(default=0)
+    run_time_seconds = models.PositiveIntegerField(default=0)
+    best_speed = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ["start"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["athlete", "period", "start"], name="unique_run_rollup"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.athlete} {self.period} {self.start}"
+
+
+class ProfilerChoices(models.TextChoices):
+    """
+    Profilers of the on-demand request profiling
+    """
+
+    DETERMINISTIC = "cprofile"
+    SAMPLING = "sample"
+
+
+class RequestProfile(models.Model):
+    """
+    Request of a staff user run under the profiler.
+    The profile and the SQL trace are files in PROFILER_DIR/<id>/.
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, related_name="request_profiles"
+    )
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    route = models.CharField(max_length=200, blank=True)
+    status = models.PositiveSmallIntegerField()
+    profiler = models.CharField(max_length=8, choices=ProfilerChoices.choices)
+    duration_ms = models.FloatField()
+    queries = models.PositiveIntegerField()
+    queries_ms = models.FloatField()
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.method} {self.path} {self.created_at:%Y-%m-%d %H:%M:%S}"
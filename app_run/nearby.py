@@ -0,0 +1,102 @@
+"""
+In-memory grid index of collectible items for nearby lookups.
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .distance import distance_km
+from .models import CollectibleItem
+from .serializers import CollectibleItemSerializerExtended
+
+# ~1.1 km of latitude per cell
+CELL_DEGREES = 0.01
+KM_PER_DEGREE = 111.32
+
+
+def get_cell(latitude, longitude):
+    return math.floor(latitude / CELL_DEGREES), math.floor(longitude / CELL_DEGREES)
+
+
+class CollectibleIndex:
+    """
+    Items grouped by grid cells of CELL_DEGREES.
+    Every worker keeps its own copy and rebuilds it when the number
+    of items or the last id changes (an xlsx upload), after local edits
+    and NEARBY_INDEX_MAX_AGE_SECONDS after the last build, so edits
+    made by other workers are seen as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._built_at = 0
+        self._cells = {}
+
+    def invalidate(self):
+        self._stamp = None
+
+    def is_fresh(self, stamp):
+        age = time.monotonic() - self._built_at
+        return stamp == self._stamp and age < settings.NEARBY_INDEX_MAX_AGE_SECONDS
+
+    def get_cells(self):
+        stamp = CollectibleItem.objects.aggregate(count=Count("id"), last=Max("id"))
+        stamp = (stamp["count"], stamp["last"])
+        if not self.is_fresh(stamp):
+            with self._lock:
+                if not self.is_fresh(stamp):
+                    self._cells = self.build()
+                    self._stamp = stamp
+                    self._built_at = time.monotonic()
+        return self._cells
+
+    def build(self):
+        cells = defaultdict(list)
+        for item in CollectibleItemSerializerExtended(
+            CollectibleItem.objects.all(), many=True
+        ).data:
+            cells[get_cell(item["latitude"], item["longitude"])].append(dict(item))
+        return dict(cells)
+
+    def nearby(self, latitude, longitude, radius, limit, exclude=()):
+        """
+        Items closer than radius km sorted by distance.
+        """
+        cells = self.get_cells()
+        lat_span = radius / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+        lon_span = min(radius / (KM_PER_DEGREE * cos_lat), 180)
+        min_x, min_y = get_cell(latitude - lat_span, longitude - lon_span)
+        max_x, max_y = get_cell(latitude + lat_span, longitude + lon_span)
+
+        found = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for item in cells.get((x, y), ()):
+                    if item["id"] in exclude:
+                        continue
+                    distance = distance_km(
+                        (latitude, longitude), (item["latitude"], item["longitude"])
+                    )
+                    if distance <= radius:
+                        found.append({**item, "distance": round(distance, 3)})
+        found.sort(key=lambda item: item["distance"])
+        return found[:limit]
+
+
+collectible_index = CollectibleIndex()
+
+
+@receiver(post_save, sender=CollectibleItem)
+@receiver(post_delete, sender=CollectibleItem)
+def invalidate_collectible_index(sender, **kwargs):
+    # edits keep the count and the last id, so the stamp would not notice them
+    collectible_index.invalidate()
@@ -0,0 +1,282 @@
+"""
+On-demand profiling of single requests.
+A staff user adds ?profile=1 (or the X-Profile header) to a request,
+it runs under cProfile, or under a sampling profiler with
+?profile=sample or while another cProfile run is active,
+and every SQL statement is traced.
+Results are written to PROFILER_DIR/<id>/ and listed in the admin:
+profile.pstats (cProfile, open with pstats or snakeviz),
+stacks.txt (collapsed stacks for flamegraph.pl or speedscope)
+and queries.json.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import ProfilerChoices, RequestProfile
+from .querylog import collect
+
+PSTATS_FILE = "profile.pstats"
+SUMMARY_FILE = "summary.txt"
+STACKS_FILE = "stacks.txt"
+QUERIES_FILE = "queries.json"
+# frames of the query collection itself
+SKIPPED_MODULES = {__name__, "app_run.querylog"}
+
+
+def frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+class Sampler:
+    """
+    Samples the stack of the thread which entered it every interval seconds
+    from a background thread, the request itself runs at full speed.
+    With all_threads every thread but the sampler is sampled, the stacks
+    start with the name of the thread.
+    """
+
+    def __init__(self, interval=0.001, all_threads=False):
+        self.interval = interval
+        self.all_threads = all_threads
+        self.stacks = Counter()
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+
+    def _sample(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if not self.all_threads:
+                frames = {self._thread_id: frames.get(self._thread_id)}
+            else:
+                frames.pop(self._sampler.ident, None)
+                if frames.keys() - names.keys():
+                    names = {
+                        thread.ident: thread.name for thread in threading.enumerate()
+                    }
+            for thread_id, frame in frames.items():
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                if self.all_threads:
+                    stack.append(names.get(thread_id, str(thread_id)))
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class QueryTrace:
+    """
+    Records every statement executed for the request,
+    with its duration and the application frame which caused it.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        self._collecting = collect(self._record)
+        self._collecting.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._collecting.__exit__(*exc_info)
+
+    def _record(self, alias, sql, params, many, duration, error):
+        self.queries.append(
+            {
+                "alias": alias,
+                "sql": sql,
+                "params": params,
+                "many": many,
+                "duration_ms": duration * 1000,
+                "error": repr(error) if error else None,
+                "caller": self._caller(),
+            }
+        )
+
+    @staticmethod
+    def _caller():
+        # the innermost frame of the project, not of django or libraries
+        frame = sys._getframe(1)
+        while frame is not None:
+            module = frame.f_globals.get("__name__", "")
+            if module.startswith("app_run.") and module not in SKIPPED_MODULES:
+                return f"{module}:{frame.f_lineno} {frame.f_code.co_name}"
+            frame = frame.f_back
+        return None
+
+    @property
+    def duration_ms(self):
+        return sum(query["duration_ms"] for query in self.queries)
+
+
+def get_requested_profiler(request):
+    flag = request.GET.get(settings.PROFILER_QUERY_PARAM) or request.headers.get(
+        "X-Profile"
+    )
+    if not flag or flag == "0":
+        return None
+    if flag == ProfilerChoices.SAMPLING:
+        return ProfilerChoices.SAMPLING
+    return ProfilerChoices.DETERMINISTIC
+
+
+def get_profiler(request):
+    """
+    Profiler asked for by the request or None.
+    Only staff users may profile.
+    """
+    profiler = get_requested_profiler(request)
+    user = getattr(request, "user", None)
+    if profiler is None or user is None or not user.is_staff:
+        return None
+    return profiler
+
+
+async def aget_profiler(request):
+    profiler = get_requested_profiler(request)
+    if profiler is None or not hasattr(request, "auser"):
+        return None
+    user = await request.auser()
+    return profiler if user.is_staff else None
+
+
+# cProfile of Python 3.12 uses sys.monitoring, which is process wide:
+# one deterministic profile at a time, it sees calls of every thread
+_deterministic = threading.Lock()
+
+
+def start_collector(profiler, all_threads=False):
+    """
+    Starts the collector of the profiler, returns it and the profiler
+    really used. A deterministic profile falls back to the sampler
+    while another one runs.
+    """
+    if profiler == ProfilerChoices.DETERMINISTIC and _deterministic.acquire(
+        blocking=False
+    ):
+        collector = cProfile.Profile()
+        try:
+            collector.enable()
+            return collector, profiler
+        except ValueError:
+            # another profiling tool, a debugger or coverage, is active
+            _deterministic.release()
+    collector = Sampler(settings.PROFILER_SAMPLE_INTERVAL, all_threads)
+    collector.__enter__()
+    return collector, ProfilerChoices.SAMPLING
+
+
+def stop_collector(collector):
+    if isinstance(collector, Sampler):
+        collector.__exit__(None, None, None)
+    else:
+        collector.disable()
+        _deterministic.release()
+
+
+def profile_request(request, get_response, profiler):
+    collector, profiler = start_collector(profiler)
+    trace = QueryTrace()
+    started = time.perf_counter()
+    try:
+        with trace:
+            response = get_response(request)
+    finally:
+        stop_collector(collector)
+    duration_ms = (time.perf_counter() - started) * 1000
+    return save_profile(request, response, profiler, collector, trace, duration_ms)
+
+
+async def aprofile_request(request, get_response, profiler):
+    """
+    Profile of an async request. Its sync parts run in worker threads,
+    so the sampler samples every thread of the process.
+    """
+    collector, profiler = start_collector(profiler, all_threads=True)
+    trace = QueryTrace()
+    started = time.perf_counter()
+    try:
+        with trace:
+            response = await get_response(request)
+    finally:
+        stop_collector(collector)
+    duration_ms = (time.perf_counter() - started) * 1000
+    return await sync_to_async(save_profile)(
+        request, response, profiler, collector, trace, duration_ms
+    )
+
+
+def save_profile(request, response, profiler, collector, trace, duration_ms):
+    match = request.resolver_match
+    profile = RequestProfile.objects.create(
+        user=request.user,
+        method=request.method,
+        path=request.get_full_path()[:2000],
+        route=match.route[:200] if match else "",
+        status=response.status_code,
+        profiler=profiler,
+        duration_ms=duration_ms,
+        queries=len(trace.queries),
+        queries_ms=trace.duration_ms,
+    )
+    save_files(profile, collector, trace)
+    remove_old_profiles()
+    response["X-Profile-Id"] = str(profile.id)
+    return response
+
+
+def get_directory(profile):
+    return Path(settings.PROFILER_DIR) / str(profile.id)
+
+
+def save_files(profile, collector, trace):
+    directory = get_directory(profile)
+    directory.mkdir(parents=True, exist_ok=True)
+    if isinstance(collector, Sampler):
+        (directory / STACKS_FILE).write_text(collector.collapsed())
+    else:
+        collector.dump_stats(directory / PSTATS_FILE)
+        summary = io.StringIO()
+        stats = pstats.Stats(collector, stream=summary)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+        (directory / SUMMARY_FILE).write_text(summary.getvalue())
+    (directory / QUERIES_FILE).write_text(
+        json.dumps(trace.queries, indent=2, default=str)
+    )
+
+
+def remove_old_profiles():
+    """
+    Keeps the last PROFILER_KEEP profiles.
+    """
+    old = list(RequestProfile.objects.all()[settings.PROFILER_KEEP :])
+    for profile in old:
+        shutil.rmtree(get_directory(profile), ignore_errors=True)
+    if old:
+        RequestProfile.objects.filter(id__in=[profile.id for profile in old]).delete()
@@ -0,0 +1,52 @@
+"""
+Statements executed on behalf of the current request.
+Every connection gets one execute wrapper when it connects. It reports
+to the collectors of a context variable, so queries of sync code which
+an async request runs in worker threads are seen as well.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_collectors = ContextVar("query_collectors", default=())
+
+
+def observe(execute, sql, params, many, context):
+    collectors = _collectors.get()
+    if not collectors:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    error = None
+    try:
+        return execute(sql, params, many, context)
+    except Exception as exc:
+        error = exc
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        for collector in collectors:
+            collector(context["connection"].alias, sql, params, many, duration, error)
+
+
+@receiver(connection_created)
+def add_wrapper(sender, connection, **kwargs):
+    if observe not in connection.execute_wrappers:
+        # first, connection.execute_wrapper() of others removes the last one
+        connection.execute_wrappers.insert(0, observe)
+
+
+@contextmanager
+def collect(collector):
+    """
+    Calls collector(alias, sql, params, many, duration, error)
+    for every statement executed inside the block.
+    """
+    token = _collectors.set(_collectors.get() + (collector,))
+    try:
+        yield
+    finally:
+        _collectors.reset(token)
@@ -0,0 +1,80 @@
+"""
+Coach ratings kept as a sum and a count on CoachStats.
+rate_coach changes them with change_rating, model saves and deletes
+of subscriptions (admin, shell, commands) through the receivers.
+"""
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import CoachStats, Subscribe
+
+
+def change_rating(coach_id, old_rating, new_rating):
+    """
+    Replaces old_rating (None for the first rating) of one athlete
+    with new_rating in the stats of the coach.
+    The database adds the difference, concurrent ratings are not lost.
+    """
+    if old_rating is not None:
+        # the stats row exists since the first rating
+        CoachStats.objects.filter(coach_id=coach_id).update(
+            rating_sum=F("rating_sum") + new_rating - old_rating
+        )
+        return
+    table = connection.ops.quote_name(CoachStats._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (coach_id, rating_sum, rating_count) "
+            f"VALUES (%s, %s, 1) ON CONFLICT (coach_id) DO UPDATE SET "
+            f"rating_sum = {table}.rating_sum + EXCLUDED.rating_sum, "
+            f"rating_count = {table}.rating_count + 1",
+            [coach_id, new_rating],
+        )
+
+
+def remove_rating(coach_id, rating):
+    # UPDATE only: the stats may be gone already when the coach is deleted
+    CoachStats.objects.filter(coach_id=coach_id).update(
+        rating_sum=F("rating_sum") - rating,
+        rating_count=F("rating_count") - 1,
+    )
+
+
+def replace_rating(coach_id, old_rating, new_rating):
+    if old_rating == new_rating:
+        return
+    if new_rating is None:
+        remove_rating(coach_id, old_rating)
+    else:
+        change_rating(coach_id, old_rating, new_rating)
+
+
+@receiver(pre_save, sender=Subscribe)
+def remember_rating(sender, instance, **kwargs):
+    instance._stored_rating = (
+        Subscribe.objects.filter(pk=instance.pk).values("coach_id", "rating").first()
+        if instance.pk is not None
+        else None
+    )
+
+
+@receiver(post_save, sender=Subscribe)
+def subscription_saved(sender, instance, **kwargs):
+    stored = instance.__dict__.pop("_stored_rating", None) or {
+        "coach_id": instance.coach_id,
+        "rating": None,
+    }
+    if stored["coach_id"] == instance.coach_id:
+        replace_rating(instance.coach_id, stored["rating"], instance.rating)
+    else:
+        replace_rating(stored["coach_id"], stored["rating"], None)
+        replace_rating(instance.coach_id, None, instance.rating)
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscription_deleted(sender, instance, **kwargs):
+    if instance.rating is not None:
+        remove_rating(instance.coach_id, instance.rating)
@@ -0,0 +1,50 @@
+import orjson
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Types unknown to orjson (Decimal, timedelta, lazy strings...)
+# are converted the same way as in the stdlib renderer
+_default = JSONEncoder().default
+
+
+def dumps(data, option=0):
+    ret = orjson.dumps(
+        data,
+        default=_default,
+        option=option | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+    )
+    # Same as JSONRenderer: output is a strict javascript subset
+    return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson.
+    Compact output is byte to byte the same as the one of JSONRenderer,
+    indented output always uses 2 spaces.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        return dumps(data, orjson.OPT_INDENT_2 if indent else 0)
+
+
+class ORJSONResponse(HttpResponse):
+    """
+    Replacement of JsonResponse serialized with orjson.
+    Non ASCII characters are sent as UTF-8 instead of \\u escapes.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,103 @@
+"""
+Per-athlete weekly and monthly sums of finished runs for history charts.
+"""
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import PeriodChoices, Run, RunRollup, StatusChoices
+
+
+def get_period_starts(moment):
+    """
+    Start of the week and of the month of the moment.
+    """
+    day = timezone.localdate(moment)
+    return {
+        PeriodChoices.WEEK: day - timedelta(days=day.weekday()),
+        PeriodChoices.MONTH: day.replace(day=1),
+    }
+
+
+def add_run(run):
+    """
+    Adds the finished run to the week and the month it was started in.
+    Sums are incremented by the database, concurrent runs do not
+    overwrite each other.
+    """
+    table = connection.ops.quote_name(RunRollup._meta.db_table)
+    start = connection.ops.quote_name("start")
+    # GREATEST is called MAX on SQLite
+    greatest = "GREATEST" if connection.vendor == "postgresql" else "MAX"
+    rows = [
+        (
+            run.athlete_id,
+            period,
+            period_start,
+            run.distance or 0,
+            run.run_time_seconds or 0,
+            run.speed or 0,
+        )
+        for period, period_start in get_period_starts(run.created_at).items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (athlete_id, period, {start}, runs, distance, "
+            f"run_time_seconds, best_speed) VALUES (%s, %s, %s, 1, %s, %s, %s) "
+            f"ON CONFLICT (athlete_id, period, {start}) DO UPDATE SET "
+            f"runs = {table}.runs + 1, "
+            f"distance = {table}.distance + EXCLUDED.distance, "
+            f"run_time_seconds = {table}.run_time_seconds + EXCLUDED.run_time_seconds, "
+            f"best_speed = {greatest}({table}.best_speed, EXCLUDED.best_speed)",
+            rows,
+        )
+
+
+def rebuild(athlete_ids=None):
+    """
+    Replaces the rollups with sums over all finished runs,
+    of the given athletes only when athlete_ids is set.
+    Returns the number of rollups.
+    """
+    runs = Run.objects.filter(status=StatusChoices.FINISHED)
+    rollups = RunRollup.objects.all()
+    if athlete_ids is not None:
+        runs = runs.filter(athlete__in=athlete_ids)
+        rollups = rollups.filter(athlete__in=athlete_ids)
+
+    created = []
+    for period, trunc in (
+        (PeriodChoices.WEEK, TruncWeek),
+        (PeriodChoices.MONTH, TruncMonth),
+    ):
+        rows = (
+            runs.annotate(start=trunc("created_at"))
+            .values("athlete", "start")
+            .annotate(
+                count=Count("id"),
+                total_distance=Sum("distance"),
+                total_time=Sum("run_time_seconds"),
+                best=Max("speed"),
+            )
+            .order_by()
+        )
+        created.extend(
+            RunRollup(
+                athlete_id=row["athlete"],
+                period=period,
+                start=timezone.localdate(row["start"]),
+                runs=row["count"],
+                distance=row["total_distance"] or 0,
+                run_time_seconds=row["total_time"] or 0,
+                best_speed=row["best"] or 0,
+            )
+            for row in rows
+        )
+    with transaction.atomic():
+        rollups.delete()
+        RunRollup.objects.bulk_create(created, batch_size=1000)
+    return len(created)
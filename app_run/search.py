@@ -0,0 +1,105 @@
+"""
+Search of users by first and last name.
+Every word of the name is stored normalized in UserSearchWord,
+so a search term is matched with index lookups instead of
+a scan of auth_user.
+"""
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, IntegerField, Lookup, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework.filters import BaseFilterBackend
+
+from .models import UserSearchWord
+
+# shorter words give too many trigram matches
+TRIGRAM_MIN_LENGTH = 3
+# greater than any character, the end of a prefix range
+MAX_CHARACTER = "\U0010ffff"
+
+
+def normalize(value):
+    """
+    Case-folded words with ё written as е.
+    """
+    return value.casefold().replace("ё", "е").split()
+
+
+def get_words(user):
+    return set(normalize(f"{user.first_name} {user.last_name}"))
+
+
+def update_search_words(user):
+    UserSearchWord.objects.filter(user=user).delete()
+    UserSearchWord.objects.bulk_create(
+        UserSearchWord(user=user, word=word) for word in get_words(user)
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # a login saves only last_login
+    if update_fields and not {"first_name", "last_name"} & set(update_fields):
+        return
+    update_search_words(instance)
+
+
+class TrigramSimilar(Lookup):
+    """
+    pg_trgm similarity, served by the GIN index on the word.
+    """
+
+    lookup_name = "trigram_similar"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} %% {rhs}", [*lhs_params, *rhs_params]
+
+
+UserSearchWord._meta.get_field("word").register_lookup(TrigramSimilar)
+
+
+def match_word(token):
+    """
+    Words which start with the token.
+    PostgreSQL uses the varchar_pattern_ops index for LIKE and
+    also finds words with typos, other databases get a range of the index.
+    """
+    words = UserSearchWord.objects.all()
+    if connection.vendor == "postgresql":
+        matches = words.filter(word__startswith=token)
+        if len(token) >= TRIGRAM_MIN_LENGTH:
+            matches |= words.filter(word__trigram_similar=token)
+        return matches
+    return words.filter(word__gte=token, word__lt=token + MAX_CHARACTER)
+
+
+class UserSearchFilter(BaseFilterBackend):
+    """
+    ?search= matches users whose name has a word starting with
+    every word of the term, case and ё/е do not matter.
+    Users with more words matching exactly come first,
+    the ordering of the view decides between equal ones.
+    """
+
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = normalize(request.query_params.get(self.search_param, ""))
+        if not tokens:
+            return queryset
+        for token in tokens:
+            queryset = queryset.filter(id__in=match_word(token).values("user_id"))
+        exact = (
+            UserSearchWord.objects.filter(user=OuterRef("pk"), word__in=tokens)
+            .values("user")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return queryset.annotate(
+            search_rank=Coalesce(Subquery(exact, output_field=IntegerField()), Value(0))
+        ).order_by("-search_rank", *queryset.query.order_by)
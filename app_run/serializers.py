@@ -1,9 +1,31 @@
 from rest_framework import serializers
-from .models import Run, Challenge, Position, StatusChoices, CollectibleItem, Subscribe
+from .models import (
+    Run,
+    Challenge,
+    Position,
+    StatusChoices,
+    CollectibleItem,
+    Subscribe,
+    Split,
+    BestEffort,
+    RunRollup,
+)
 from django.contrib.auth.models import User
 from .utils import validate_latitude, validate_longitude
 
 
+class SparseFieldsMixin:
+    """
+    fields=[...] keeps only the given fields of the serializer.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class AthleteSerializer(serializers.ModelSerializer):
     """
     Serializer for Athlete.
@@ -15,7 +37,7 @@ class AthleteSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "last_name", "first_name"]
 
 
-class RunSerializer(serializers.ModelSerializer):
+class RunSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Run Model
     There is nested serializer for UserModel
@@ -54,7 +76,7 @@ class CollectibleItemSerializerExtended(CollectibleItemSerializer):
         fields = CollectibleItemSerializer.Meta.fields + ["id"]
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for User Model
     Custom Field is added based on is_staff property
@@ -128,7 +150,7 @@ class ChallengesSerializer(serializers.ModelSerializer):
         fields = ["full_name", "athlete"]
 
 
-class PositionSerializer(serializers.ModelSerializer):
+class PositionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Position model serializer
     Additional validation for run status, and valid latitude and longitude
@@ -158,6 +180,117 @@ class PositionSerializer(serializers.ModelSerializer):
         return value
 
 
+class AsyncPositionSerializer(PositionSerializer):
+    """
+    Position serializer for the async ingest endpoint.
+    Field validation is pure python, the run is fetched with async ORM
+    so the serializer never blocks the event loop.
+    """
+
+    run = serializers.IntegerField(source="run_id")
+
+    def validate_run(self, value):
+        # The run is checked in ais_valid, it needs a database round trip
+        return value
+
+    async def ais_valid(self):
+        if not self.is_valid():
+            return False
+        run_id = self.validated_data["run_id"]
+        run = await Run.objects.select_related("athlete").filter(id=run_id).afirst()
+        try:
+            if run is None:
+                raise serializers.ValidationError(
+                    serializers.PrimaryKeyRelatedField.default_error_messages[
+                        "does_not_exist"
+                    ].format(pk_value=run_id)
+                )
+            super().validate_run(run)
+        except serializers.ValidationError as exc:
+            self._errors = {"run": exc.detail}
+            self._validated_data = {}
+            return False
+        self.run = run
+        return True
+
+
+class SplitSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Split
+        fields = ["km", "seconds"]
+
+
+class BestEffortSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BestEffort
+        fields = ["distance", "seconds", "run"]
+
+
+class RunRollupSerializer(serializers.ModelSerializer):
+    """
+    One point of the history chart.
+    avg_speed (meters per second) is the pace of the whole period.
+    """
+
+    avg_speed = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RunRollup
+        fields = [
+            "start",
+            "runs",
+            "distance",
+            "run_time_seconds",
+            "avg_speed",
+            "best_speed",
+        ]
+
+    def get_avg_speed(self, obj):
+        if not obj.run_time_seconds:
+            return 0
+        return round(obj.distance * 1000 / obj.run_time_seconds, 2)
+
+
+class DashboardRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Run
+        fields = ["id", "created_at", "distance", "run_time_seconds", "speed"]
+
+
+class DashboardAthleteSerializer(serializers.ModelSerializer):
+    """
+    Athlete on the coach dashboard.
+    Totals are annotations and runs and challenges are prefetched
+    by dashboard.get_athletes, rating is the one given to the coach.
+    """
+
+    rating = serializers.IntegerField(read_only=True)
+    runs_finished = serializers.IntegerField(read_only=True)
+    total_distance = serializers.FloatField(read_only=True)
+    total_run_time_seconds = serializers.IntegerField(read_only=True)
+    best_speed = serializers.FloatField(read_only=True)
+    recent_runs = DashboardRunSerializer(many=True, read_only=True)
+    challenges = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field="full_name"
+    )
+
+    class Meta:
+        model = User
+        fields = [
+            "id",
+            "username",
+            "last_name",
+            "first_name",
+            "rating",
+            "runs_finished",
+            "total_distance",
+            "total_run_time_seconds",
+            "best_speed",
+            "recent_runs",
+            "challenges",
+        ]
+
+
 class AthleteChallengeSerializer(serializers.ModelSerializer):
     """
     Serializer for athelte data used as nested in ChallengesDisplay
@@ -176,3 +309,81 @@ class AthleteChallengeSerializer(serializers.ModelSerializer):
 class TotalChallengesSerializer(serializers.Serializer):
     name_to_display = serializers.CharField()
     athletes = AthleteChallengeSerializer(many=True)
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path for list endpoints.
+    Fields of a ModelSerializer are compiled once into values_list() lookups
+    and converters, rows become the same dicts the serializer would return
+    without building model instances.
+    """
+
+    _compiled = {}
+
+    def __init__(self, serializer):
+        self.lookups = []
+        self.layout = self.compile(serializer, prefix="")
+
+    @classmethod
+    def for_class(cls, serializer_class, fields=None):
+        """
+        fields trims serializers with SparseFieldsMixin.
+        """
+        key = (serializer_class, fields)
+        if key not in cls._compiled:
+            kwargs = {} if fields is None else {"fields": fields}
+            cls._compiled[key] = cls(serializer_class(**kwargs))
+        return cls._compiled[key]
+
+    def compile(self, serializer, prefix):
+        layout = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            lookup = prefix + "__".join(field.source_attrs)
+            if isinstance(field, serializers.BaseSerializer):
+                # nested dict, None when the relation is empty
+                index = self.index(lookup)
+                layout.append((name, index, self.compile(field, lookup + "__")))
+            elif isinstance(field, serializers.SerializerMethodField) or not lookup:
+                raise TypeError(f"{name} can not be read with values_list()")
+            else:
+                layout.append((name, self.index(lookup), self.converter(field)))
+        return layout
+
+    def index(self, lookup):
+        if lookup not in self.lookups:
+            self.lookups.append(lookup)
+        return self.lookups.index(lookup)
+
+    def converter(self, field):
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            return None
+        if isinstance(field, serializers.ChoiceField):
+            choices = field.choice_strings_to_values
+            return lambda value: choices.get(str(value), value)
+        # to_representation of these fields is exactly the builtin
+        builtin = {
+            serializers.IntegerField: int,
+            serializers.FloatField: float,
+            serializers.CharField: str,
+        }
+        return builtin.get(type(field), field.to_representation)
+
+    def to_representation(self, rows):
+        layout = self.layout
+        build = self.build
+        return [build(layout, row) for row in rows]
+
+    def build(self, layout, row):
+        ret = {}
+        for name, index, convert in layout:
+            value = row[index]
+            if value is None or convert is None:
+                ret[name] = value
+            elif type(convert) is list:
+                ret[name] = self.build(convert, row)
+            else:
+                ret[name] = convert(value)
+        return ret
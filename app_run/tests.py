@@ -1,10 +1,66 @@
 # from rest_framework.test import APIRequestFactory
+import asyncio
+import cProfile
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from django.conf import settings
-from .models import Run, Challenge, StatusChoices, Position, CollectibleItem
+from django.core.handlers.asgi import ASGIHandler
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import (
+    AthleteInfo,
+    CoachStats,
+    RunRollup,
+    Subscribe,
+    Run,
+    Challenge,
+    StatusChoices,
+    Position,
+    CollectibleItem,
+    RequestProfile,
+    Split,
+    BestEffort,
+)
 from django.contrib.auth.models import User
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from geopy import Point
+from geopy.distance import geodesic
+from prometheus_client import REGISTRY
+from .buffer import get_position_buffer
+from . import profiling, rollups
+from .management.commands.import_profile import profile_imports
+from .distance import cache_clear, cache_info, distance_m
+from .metrics import record_distance_cache
+from .heatmap import get_cell
+from .live import get_broker
+from .parsers import ORJSONParser
+from .profiling import PSTATS_FILE, QUERIES_FILE, STACKS_FILE, get_directory
+from .renderers import ORJSONRenderer
+from .serializers import PositionSerializer, RunSerializer
+from .utils import (
+    get_best_effort,
+    get_speed_and_distance,
+    get_splits,
+    segment_distance_km,
+    sweep_collectible_items,
+)
+from .views import StopRunView, schedule_side_effect, wait_side_effects
+from .warmup import PRELOADED_MODULES, warm_up
 
 
 class CompanyInfoTestCase(APITestCase):
@@ -138,6 +194,14 @@ class ChangeRunStatusTest(APITestCase):
         response = self.client.post(self.url_stop_wrong)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_second_stop_changes_nothing(self):
+        self.client.post(self.url_stop)
+        Run.objects.filter(id=self.run_in_progress.id).update(distance=42)
+        response = self.client.post(self.url_stop)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.run_in_progress.refresh_from_db()
+        self.assertEqual(self.run_in_progress.distance, 42)
+
 
 class GetAthleteInfoTest(APITestCase):
     """
@@ -145,6 +209,7 @@ class GetAthleteInfoTest(APITestCase):
     """
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(
             username="testuser", password="password123"
         )
@@ -168,6 +233,26 @@ class GetAthleteInfoTest(APITestCase):
         response = self.client.put(self.url, self.valid_payload, format="json")
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_get_does_not_write(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.json(), {"goals": "", "weight": None, "user_id": self.user.id}
+        )
+        self.assertFalse(AthleteInfo.objects.exists())
+        response = self.client.get("/api/athlete_info/999/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_is_cached(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        self.client.put(self.url, self.valid_payload, format="json")
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(
+            response.json(), {"goals": "yo!", "weight": 98, "user_id": self.user.id}
+        )
+
     def test_put_invalid(self):
         response = self.client.put(self.url, self.invalid_payload, format="json")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -289,3 +374,1690 @@ class CollectibleItemSerializer(APITestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(CollectibleItem.objects.all().exists())
+
+
+class AsyncPositionIngestTest(APITestCase):
+    """
+    Test case for the async position ingest endpoint
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="cool", status=StatusChoices.IN_PROGRESS
+        )
+        self.run_finished = Run.objects.create(
+            athlete=self.user, comment="done", status=StatusChoices.FINISHED
+        )
+        self.item = CollectibleItem.objects.create(
+            name="Champ's T-Shirt",
+            uid="37729fh2",
+            latitude=55.7501,
+            longitude=37.6101,
+            picture="https://google.com",
+            value=3,
+        )
+        self.url = "/api/positions/ingest/"
+
+    async def test_ingest_positions(self):
+        first = await self.async_client.post(
+            self.url,
+            {
+                "run": self.run1.id,
+                "latitude": 55.75,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+            content_type="application/json",
+        )
+        second = await self.async_client.post(
+            self.url,
+            {
+                "run": self.run1.id,
+                "latitude": 55.751,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:40.000000",
+            },
+            content_type="application/json",
+        )
+        await wait_side_effects()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        data = second.json()
+        self.assertEqual(data["run"], self.run1.id)
+        self.assertEqual(data["date_time"], "2025-10-12T10:00:40.000000")
+        self.assertEqual(data["distance"], 0.11)
+        self.assertEqual(data["speed"], 2.78)
+        self.assertEqual(await Position.objects.filter(run=self.run1).acount(), 2)
+        self.assertTrue(await self.item.users.filter(id=self.user.id).aexists())
+
+    async def test_ingest_repeated_position(self):
+        payload = {
+            "run": self.run1.id,
+            "latitude": 55.75,
+            "longitude": 37.61,
+            "date_time": "2025-10-12T10:00:00.000000",
+        }
+        first = await self.async_client.post(
+            self.url, payload, content_type="application/json"
+        )
+        second = await self.async_client.post(
+            self.url, payload, content_type="application/json"
+        )
+        await wait_side_effects()
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.json()["id"], second.json()["id"])
+        self.assertEqual(await Position.objects.filter(run=self.run1).acount(), 1)
+
+    async def test_ingest_wrong_run(self):
+        payload = {
+            "latitude": 55.75,
+            "longitude": 37.61,
+            "date_time": "2025-10-12T10:00:00.000000",
+        }
+        for run_id in (self.run_finished.id, 1000):
+            response = await self.async_client.post(
+                self.url, {**payload, "run": run_id}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("run", response.json())
+
+    async def test_failed_side_effect_is_logged(self):
+        def award():
+            raise RuntimeError("no connection")
+
+        with self.assertLogs("app_run.views", "ERROR") as logs:
+            schedule_side_effect(award)
+            await wait_side_effects()
+        self.assertIn("award failed", logs.output[0])
+        self.assertIsInstance(logs.records[0].exc_info[1], RuntimeError)
+
+    async def test_ingest_wrong_latitude(self):
+        response = await self.async_client.post(
+            self.url,
+            {
+                "run": self.run1.id,
+                "latitude": 90.1,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LivePositionsTest(APITestCase):
+    """
+    Test case for Server-Sent Events stream of a run
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="cool", status=StatusChoices.IN_PROGRESS
+        )
+        self.seen = Position.objects.create(
+            run=self.run1,
+            latitude=55.75,
+            longitude=37.61,
+            date_time=datetime(2025, 10, 12, 9, 59, 0, tzinfo=timezone.utc),
+            speed=0,
+            distance=0,
+        )
+        self.missed = Position.objects.create(
+            run=self.run1,
+            latitude=55.751,
+            longitude=37.61,
+            date_time=datetime(2025, 10, 12, 9, 59, 30, tzinfo=timezone.utc),
+            speed=0,
+            distance=0,
+        )
+        self.url = f"/api/runs/{self.run1.id}/live/"
+
+    async def test_stream_resumes_and_pushes_new_positions(self):
+        response = await self.async_client.get(
+            self.url, headers={"Last-Event-ID": str(self.seen.id)}
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+
+        missed = (await anext(events)).decode()
+        self.assertTrue(missed.startswith(f"id: {self.missed.id}\nevent: position\n"))
+
+        created = await self.async_client.post(
+            "/api/positions/",
+            {
+                "run": self.run1.id,
+                "latitude": 55.752,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+            format="json",
+        )
+        pushed = (await anext(events)).decode()
+        self.assertIn(f"id: {created.data['id']}\n", pushed)
+        self.assertIn('"latitude":55.752', pushed)
+
+        await self.async_client.post(f"/api/runs/{self.run1.id}/stop/")
+        finished = (await anext(events)).decode()
+        self.assertTrue(finished.startswith("event: finished\n"))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+    async def test_stream_pushes_ingested_positions(self):
+        response = await self.async_client.get(
+            self.url, headers={"Last-Event-ID": str(self.seen.id)}
+        )
+        events = aiter(response.streaming_content)
+        # the stream is subscribed once it has caught up
+        await anext(events)
+        created = await self.async_client.post(
+            "/api/positions/ingest/",
+            {
+                "run": self.run1.id,
+                "latitude": 55.753,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+            content_type="application/json",
+        )
+        pushed = (await asyncio.wait_for(anext(events), 5)).decode()
+        self.assertIn(f"id: {created.json()['id']}\n", pushed)
+        self.assertIn('"latitude":55.753', pushed)
+        await wait_side_effects()
+
+    async def assert_stream_waits_for_start(self):
+        run = await Run.objects.acreate(athlete=self.user, comment="later")
+        await Position.objects.acreate(
+            run=run,
+            latitude=55.75,
+            longitude=37.61,
+            date_time=datetime(2025, 10, 12, 9, 59, 0, tzinfo=timezone.utc),
+            speed=0,
+            distance=0,
+        )
+        response = await self.async_client.get(f"/api/runs/{run.id}/live/")
+        events = aiter(response.streaming_content)
+        await anext(events)
+        await self.async_client.post(f"/api/runs/{run.id}/start/")
+        created = await self.async_client.post(
+            "/api/positions/ingest/",
+            {
+                "run": run.id,
+                "latitude": 55.751,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+            content_type="application/json",
+        )
+        pushed = (await asyncio.wait_for(anext(events), 5)).decode()
+        self.assertIn(f"id: {created.json()['id']}\nevent: position\n", pushed)
+        await wait_side_effects()
+
+    async def test_stream_waits_for_start(self):
+        await self.assert_stream_waits_for_start()
+
+    @override_settings(
+        LIVE_TRACKING={
+            "BACKEND": "app_run.live.DatabaseBroker",
+            "OPTIONS": {"poll_interval": 0.05},
+        }
+    )
+    async def test_database_stream_waits_for_start(self):
+        get_broker.cache_clear()
+        try:
+            await self.assert_stream_waits_for_start()
+        finally:
+            get_broker.cache_clear()
+
+    def test_stream_wrong_run(self):
+        response = self.client.get("/api/runs/1000/live/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTest(APITransactionTestCase):
+    """
+    Test case for sending safe requests to the read replica
+    """
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.coach = User.objects.create_user(
+            username="coachuser", password="password123", is_staff=True
+        )
+        self.athlete = User.objects.create_user(
+            username="athleteuser", password="password123"
+        )
+
+    def count_replica_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connections["replica"]) as queries:
+            response = getattr(self.client, method)(url, data, format="json")
+        return response, len(queries)
+
+    def test_read_only_view_reads_from_replica(self):
+        response, replica_queries = self.count_replica_queries("get", "/api/users/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        self.assertGreater(replica_queries, 0)
+
+    def test_other_views_read_from_primary(self):
+        _, replica_queries = self.count_replica_queries("get", "/api/runs/")
+        self.assertEqual(replica_queries, 0)
+
+    def test_read_after_write_goes_to_primary(self):
+        response, replica_queries = self.count_replica_queries(
+            "post",
+            f"/api/subscribe_to_coach/{self.coach.id}/",
+            {"athlete": self.athlete.id},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(replica_queries, 0)
+        _, replica_queries = self.count_replica_queries(
+            "get", f"/api/users/{self.coach.id}/"
+        )
+        self.assertEqual(replica_queries, 0)
+
+    def test_cached_read_does_not_write(self):
+        cache.clear()
+        url = f"/api/athlete_info/{self.athlete.id}/"
+        for _ in range(2):
+            with CaptureQueriesContext(connections["default"]) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(all(query["sql"].startswith("SELECT") for query in queries))
+
+
+class ORJSONTest(APITestCase):
+    """
+    Test case for orjson renderer and parser
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="бегун", first_name="Ёжик", last_name="Туманов"
+        )
+        self.payload = {
+            "name": "Сделай 10 Забегов!",
+            "date_time": datetime(2025, 10, 12, 10, 0, 0, 123456, tzinfo=timezone.utc),
+            "date": date(2025, 10, 12),
+            "value": Decimal("12.50"),
+            "duration": timedelta(minutes=10),
+            "items": [1, 2.5, None, True],
+            "separators": "\u2028\u2029",
+        }
+
+    def test_renderer_matches_stdlib(self):
+        self.assertEqual(
+            ORJSONRenderer().render(self.payload),
+            JSONRenderer().render(self.payload),
+        )
+
+    def test_users_cyrillic(self):
+        response = self.client.get("/api/users/")
+        self.assertEqual(response.data[0]["first_name"], "Ёжик")
+        self.assertIn("Ёжик".encode(), response.content)
+
+    def test_parser(self):
+        parsed = ORJSONParser().parse(io.BytesIO('{"goals": "Бегать"}'.encode()))
+        self.assertEqual(parsed, {"goals": "Бегать"})
+        response = self.client.put(
+            f"/api/athlete_info/{self.user.id}/",
+            '{"goals": "Бегать", "weight": 70',
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_json_response(self):
+        response = self.client.post(f"/api/rate_coach/{self.user.id}/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"info": "Можно дать оценку только тренеру"})
+
+
+class ValuesListParityTest(APITestCase):
+    """
+    Test case for the values_list() fast path of list endpoints
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="бегун", first_name="Ёжик", last_name="Туманов"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="Бегаем!", status=StatusChoices.IN_PROGRESS
+        )
+        self.run2 = Run.objects.create(
+            athlete=self.user,
+            status=StatusChoices.FINISHED,
+            distance=2.5,
+            run_time_seconds=600,
+            speed=4.17,
+        )
+        Position.objects.create(
+            run=self.run1,
+            latitude=55.75,
+            longitude=37.61,
+            date_time=datetime(2025, 10, 12, 10, 0, 0, 123456, tzinfo=timezone.utc),
+            speed=0,
+            distance=0,
+        )
+        Position.objects.create(run=self.run1, latitude=-34.609, longitude=-58.371)
+
+    def assert_same_output(self, url, serializer):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, ORJSONRenderer().render(serializer.data))
+
+    def test_runs(self):
+        runs = Run.objects.order_by("id")
+        self.assert_same_output("/api/runs/", RunSerializer(runs, many=True))
+        self.assert_same_output(
+            "/api/runs/?status=finished",
+            RunSerializer(runs.filter(status=StatusChoices.FINISHED), many=True),
+        )
+
+    def test_runs_paginated(self):
+        response = self.client.get("/api/runs/?size=1&page=2")
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(
+            ORJSONRenderer().render(response.data["results"]),
+            ORJSONRenderer().render(RunSerializer([self.run2], many=True).data),
+        )
+
+    def test_positions(self):
+        positions = Position.objects.filter(run=self.run1)
+        self.assert_same_output(
+            f"/api/positions/?run={self.run1.id}",
+            PositionSerializer(positions, many=True),
+        )
+
+
+class SplitsTest(APITestCase):
+    """
+    Test case for kilometre splits and best efforts computed at run stop
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="cool", status=StatusChoices.IN_PROGRESS
+        )
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        # positions a kilometre (and a millimetre) apart to the north
+        point = Point(55.75, 37.61)
+        for seconds, distance in ((0, 0), (300, 1.0), (540, 2.0), (900, 3.0)):
+            Position.objects.create(
+                run=self.run1,
+                latitude=point.latitude,
+                longitude=point.longitude,
+                date_time=start + timedelta(seconds=seconds),
+                distance=distance,
+                speed=0,
+            )
+            point = geodesic(kilometers=1.000001).destination(point, bearing=0)
+
+    def test_splits_and_best_efforts(self):
+        self.client.post(f"/api/runs/{self.run1.id}/stop/")
+        response = self.client.get(f"/api/runs/{self.run1.id}/splits/")
+        self.assertEqual(
+            [split["seconds"] for split in response.data["splits"]], [300, 240, 360]
+        )
+        self.assertEqual(
+            response.data["best_efforts"],
+            [{"distance": 1, "seconds": 240, "run": self.run1.id}],
+        )
+
+        response = self.client.get(f"/api/personal_bests/{self.user.id}/")
+        self.assertEqual(response.data[0]["seconds"], 240)
+
+    def test_splits_of_a_dense_track(self):
+        # 1 Hz fixes 11 m apart, every stored segment is rounded to 0.01 km
+        run = Run.objects.create(athlete=self.user, status=StatusChoices.IN_PROGRESS)
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        positions = []
+        last_position = None
+        for second in range(460):
+            position = Position(
+                run=run,
+                latitude=round(55.7 + second * 0.0001, 4),
+                longitude=37.61,
+                date_time=start + timedelta(seconds=second),
+            )
+            position.speed, position.distance = get_speed_and_distance(
+                last_position,
+                position.latitude,
+                position.longitude,
+                position.date_time,
+            )
+            positions.append(position)
+            last_position = position
+        Position.objects.bulk_create(positions)
+        self.assertLess(last_position.distance, 5)
+
+        self.client.post(f"/api/runs/{run.id}/stop/")
+        run.refresh_from_db()
+        self.assertGreater(run.distance, 5)
+        self.assertEqual(Split.objects.filter(run=run).count(), 5)
+        self.assertTrue(BestEffort.objects.filter(run=run, distance=5).exists())
+
+    def test_interpolated_splits(self):
+        points = [(0, 0), (100, 0.5), (400, 1.5), (500, 1.6)]
+        self.assertEqual(get_splits(points), [250])
+        self.assertEqual(get_best_effort(points, 1), 300)
+        self.assertIsNone(get_best_effort(points, 5))
+
+
+class PositionBucketsTest(APITestCase):
+    """
+    Test case for downsampled positions of a run
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="cool", status=StatusChoices.IN_PROGRESS
+        )
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        for second in range(6):
+            Position.objects.create(
+                run=self.run1,
+                latitude=55.75 + second * 0.001,
+                longitude=37.61,
+                date_time=start + timedelta(seconds=second),
+                speed=second,
+                distance=second / 100,
+            )
+
+    def test_buckets(self):
+        response = self.client.get(f"/api/positions/?run={self.run1.id}&resolution=3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        first, second = response.data
+        self.assertEqual(first["date_time"], "2025-10-12T10:00:00.000000")
+        self.assertEqual(first["points"], 3)
+        self.assertEqual(first["speed"], 1)
+        self.assertEqual(first["distance"], 0.02)
+        self.assertAlmostEqual(first["latitude"], 55.751)
+        self.assertEqual(second["date_time"], "2025-10-12T10:00:03.000000")
+        self.assertEqual(second["distance"], 0.05)
+
+    def test_wrong_resolution(self):
+        response = self.client.get(f"/api/positions/?run={self.run1.id}&resolution=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecomputeRunsTest(APITestCase):
+    """
+    Test case for the recompute_runs management command
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="cool", status=StatusChoices.FINISHED
+        )
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        for second in range(3):
+            Position.objects.create(
+                run=self.run1,
+                latitude=55.75 + second * 0.001,
+                longitude=37.61,
+                date_time=start + timedelta(seconds=second * 40),
+            )
+        self.checkpoint = Path(tempfile.mkdtemp()) / "checkpoint.json"
+
+    def test_recompute_and_resume(self):
+        call_command(
+            "recompute_runs",
+            workers=1,
+            checkpoint=self.checkpoint,
+            stdout=io.StringIO(),
+        )
+        self.run1.refresh_from_db()
+        self.assertEqual(self.run1.distance, 0.223)
+        self.assertEqual(self.run1.run_time_seconds, 80)
+        positions = Position.objects.filter(run=self.run1).order_by("date_time")
+        self.assertEqual([p.distance for p in positions], [0, 0.11, 0.22])
+        self.assertEqual(positions[1].speed, 2.78)
+
+        out = io.StringIO()
+        call_command(
+            "recompute_runs", workers=1, checkpoint=self.checkpoint, stdout=out
+        )
+        self.assertIn("0 of 1 shards to recompute", out.getvalue())
+
+
+class TrackLengthInDatabaseTest(APITestCase):
+    """
+    Test case for the track length computed with LAG() and haversine
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run1 = Run.objects.create(
+            athlete=self.user, comment="cool", status=StatusChoices.IN_PROGRESS
+        )
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        # a loop with every heading, positions are created out of time order
+        track = [(55.75, 37.61), (55.76, 37.61), (55.76, 37.63), (55.74, 37.64)]
+        track += [(55.74, 37.6), (55.7512, 37.6023), (55.75, 37.61)]
+        for index in (3, 0, 6, 2, 5, 1, 4):
+            Position.objects.create(
+                run=self.run1,
+                latitude=track[index][0],
+                longitude=track[index][1],
+                date_time=start + timedelta(minutes=index),
+                speed=3,
+            )
+
+    def test_matches_geodesic(self):
+        view = StopRunView()
+        geodesic_track = view.get_geodesic_track(self.run1)
+        database_track = view.get_track_in_database(self.run1)
+        self.assertEqual(
+            [row[:2] for row in database_track], [row[:2] for row in geodesic_track]
+        )
+        for (*_, geodesic_km), (*_, database_km) in zip(geodesic_track, database_track):
+            self.assertAlmostEqual(database_km, geodesic_km, delta=geodesic_km * 0.005)
+        geodesic_km, _ = view.get_total_km(self.run1, geodesic_track)
+        self.assertAlmostEqual(geodesic_km, 8.93, delta=0.05)
+
+    @override_settings(TRACK_LENGTH_IN_DATABASE=True)
+    def test_compare_command(self):
+        out = io.StringIO()
+        call_command("compare_track_length", stdout=out)
+        # geodesic against haversine, not the database path against itself
+        error = float(out.getvalue().split("max error ")[1].split("%")[0])
+        self.assertGreater(error, 0)
+        self.assertLess(error, 0.5)
+
+    @override_settings(TRACK_LENGTH_IN_DATABASE=True)
+    def test_stop_run(self):
+        response = self.client.post(f"/api/runs/{self.run1.id}/stop/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.run1.refresh_from_db()
+        self.assertAlmostEqual(self.run1.distance, 8.93, delta=0.01)
+        self.assertEqual(self.run1.run_time_seconds, 360)
+        self.assertEqual(self.run1.speed, 3)
+
+
+class DistanceCacheTest(APITestCase):
+    """
+    Test case for the cached geodesic distance
+    """
+
+    def setUp(self):
+        cache_clear()
+        self.admin = User.objects.create_superuser(
+            username="my_super", password="password123"
+        )
+
+    def test_same_as_geodesic(self):
+        start, finish = (55.7512, 37.6101), (55.7498, 37.6243)
+        self.assertAlmostEqual(
+            distance_m(start, finish), geodesic(start, finish).meters, places=6
+        )
+        distance_m(finish, start)
+        self.assertEqual(cache_info()["hits"], 1)
+
+    def test_off_grid_points_bypass_cache(self):
+        start, finish = (55.75123, 37.61), (55.75, 37.61)
+        self.assertEqual(distance_m(start, finish), geodesic(start, finish).meters)
+        self.assertEqual(cache_info()["size"], 0)
+
+    def test_stats_for_staff_only(self):
+        response = self.client.get("/api/distance_cache/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get("/api/distance_cache/")
+        self.assertEqual(response.data["hit_rate"], 0)
+
+
+class HeatmapTest(APITestCase):
+    """
+    Test case for the heatmap aggregated at run stop
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.runs = [
+            Run.objects.create(athlete=self.user, status=StatusChoices.IN_PROGRESS)
+            for _ in range(2)
+        ]
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        for run in self.runs:
+            for second, latitude in enumerate((55.75, 55.75, 55.7501, 40.0)):
+                Position.objects.create(
+                    run=run,
+                    latitude=latitude,
+                    longitude=37.61,
+                    date_time=start + timedelta(seconds=second),
+                    speed=0,
+                    distance=0,
+                )
+        self.url = "/api/heatmap/?zoom=12&bbox=37.5,55.7,37.7,55.8"
+
+    def test_counts_are_added_at_stop(self):
+        for run in self.runs:
+            self.client.post(f"/api/runs/{run.id}/stop/")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        x, y = get_cell(55.75, 37.61, 12)
+        self.assertEqual(response.data["cells"], [{"x": x, "y": y, "count": 6}])
+
+    def test_second_stop_is_not_counted(self):
+        cache.clear()
+        for _ in range(2):
+            self.client.post(f"/api/runs/{self.runs[0].id}/stop/")
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["cells"][0]["count"], 3)
+
+    def test_wrong_params(self):
+        response = self.client.get("/api/heatmap/?zoom=11&bbox=37.5,55.7,37.7,55.8")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/heatmap/?zoom=16&bbox=-180,-80,180,80")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NearbyCollectibleItemsTest(APITestCase):
+    """
+    Test case for the nearby collectible items
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.items = [
+            CollectibleItem.objects.create(
+                name=name,
+                uid=name,
+                latitude=latitude,
+                longitude=37.61,
+                picture="https://example.com/item.png",
+                value=1,
+            )
+            for name, latitude in (
+                ("far", 55.80),
+                ("second", 55.755),
+                ("first", 55.7505),
+                ("owned", 55.751),
+            )
+        ]
+        self.items[3].users.add(self.user)
+        self.url = "/api/collectible_item/nearby/?lat=55.75&lon=37.61"
+
+    def test_sorted_by_distance(self):
+        response = self.client.get(f"{self.url}&radius=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item["name"] for item in response.data], ["first", "owned", "second"]
+        )
+        self.assertEqual(response.data[0]["distance"], 0.056)
+
+    def test_owned_items_are_skipped(self):
+        response = self.client.get(f"{self.url}&radius=2&athlete={self.user.id}")
+        self.assertEqual([item["name"] for item in response.data], ["first", "second"])
+
+    def test_limit_and_new_items(self):
+        response = self.client.get(f"{self.url}&radius=10&limit=3")
+        self.assertEqual(len(response.data), 3)
+        CollectibleItem.objects.create(
+            name="new",
+            uid="new",
+            latitude=55.75,
+            longitude=37.61,
+            picture="https://example.com/item.png",
+            value=1,
+        )
+        response = self.client.get(f"{self.url}&limit=1")
+        self.assertEqual(response.data[0]["name"], "new")
+
+    def test_edits_of_other_workers(self):
+        self.client.get(f"{self.url}&radius=2")
+        # an edit in another worker sends no signal to this one
+        CollectibleItem.objects.filter(name="far").update(latitude=55.7502)
+        response = self.client.get(f"{self.url}&limit=1")
+        self.assertEqual(response.data[0]["name"], "first")
+        with override_settings(NEARBY_INDEX_MAX_AGE_SECONDS=0):
+            response = self.client.get(f"{self.url}&limit=1")
+        self.assertEqual(response.data[0]["name"], "far")
+
+    def test_wrong_params(self):
+        response = self.client.get("/api/collectible_item/nearby/?lat=55.75")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{self.url}&radius=1000")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(COLLECTIBLES_PER_POSITION=False)
+class CollectibleSweepTest(APITestCase):
+    """
+    Test case for collectible items awarded by the whole track at run stop
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run = Run.objects.create(
+            athlete=self.user, status=StatusChoices.IN_PROGRESS
+        )
+        start = datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc)
+        for second, longitude in enumerate((37.60, 37.62)):
+            Position.objects.create(
+                run=self.run,
+                latitude=55.75,
+                longitude=longitude,
+                date_time=start + timedelta(seconds=second * 300),
+                speed=0,
+                distance=0,
+            )
+        self.passed, self.far = [
+            CollectibleItem.objects.create(
+                name=name,
+                uid=name,
+                latitude=latitude,
+                longitude=37.61,
+                picture="https://example.com/item.png",
+                value=1,
+            )
+            for name, latitude in (("passed", 55.7504), ("far", 55.7520))
+        ]
+
+    def test_item_between_fixes_is_collected(self):
+        self.client.post(f"/api/runs/{self.run.id}/stop/")
+        self.assertEqual(list(self.user.items.all()), [self.passed])
+
+    def test_one_insert(self):
+        with self.assertNumQueries(3):
+            collected = sweep_collectible_items(self.run)
+        self.assertEqual(collected, [self.passed.id])
+        # collected items are not looked at again
+        with self.assertNumQueries(2):
+            self.assertEqual(sweep_collectible_items(self.run), [])
+
+    def test_segment_distance(self):
+        point = (55.7504, 37.61)
+        distance = segment_distance_km(point, (55.75, 37.60), (55.75, 37.62))
+        self.assertAlmostEqual(distance, distance_m(point, (55.75, 37.61)) / 1000, 3)
+        distance = segment_distance_km(point, (55.75, 37.62), (55.75, 37.63))
+        self.assertAlmostEqual(distance, distance_m(point, (55.75, 37.62)) / 1000, 2)
+
+
+@override_settings(
+    COLLECTIBLES_PER_POSITION=False,
+    POSITION_WRITE_BEHIND=True,
+    POSITION_BUFFER={
+        "BACKEND": "app_run.buffer.InMemoryPositionBuffer",
+        "OPTIONS": {"max_size": 3, "max_age": 60},
+    },
+)
+class PositionBufferTest(APITestCase):
+    """
+    Test case for the write-behind buffer of positions
+    """
+
+    def setUp(self):
+        get_position_buffer.cache_clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run = Run.objects.create(
+            athlete=self.user, status=StatusChoices.IN_PROGRESS
+        )
+
+    def tearDown(self):
+        get_position_buffer.cache_clear()
+
+    def post_position(self, second, latitude):
+        return self.client.post(
+            "/api/positions/",
+            {
+                "run": self.run.id,
+                "latitude": latitude,
+                "longitude": 37.61,
+                "date_time": f"2025-10-12T10:00:{second:02}.000000",
+            },
+        )
+
+    def test_flush_on_size(self):
+        first = self.post_position(0, 55.75)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(first.data["id"])
+        second = self.post_position(10, 55.7501)
+        self.assertEqual(second.data["speed"], 1.11)
+        self.assertFalse(Position.objects.exists())
+
+        with self.assertNumQueries(2):
+            # the run for the serializer and one insert of three positions
+            self.post_position(20, 55.7502)
+        positions = Position.objects.filter(run=self.run).order_by("date_time")
+        self.assertEqual(
+            list(positions.values_list("distance", flat=True)), [0, 0.01, 0.02]
+        )
+
+    def test_flush_on_stop(self):
+        self.post_position(0, 55.75)
+        self.post_position(10, 55.7501)
+        response = self.client.post(f"/api/runs/{self.run.id}/stop/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 2)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.distance, 0.011)
+
+    def test_repeated_and_late_positions(self):
+        self.post_position(0, 55.75)
+        self.post_position(20, 55.752)
+        # a retried fix flushes the run and gets the stored position back
+        repeated = self.post_position(20, 55.752)
+        self.assertEqual(repeated.status_code, status.HTTP_201_CREATED)
+        stored = Position.objects.get(run=self.run, latitude=55.752)
+        self.assertEqual(repeated.data["id"], stored.id)
+        late = self.post_position(10, 55.7505)
+        self.assertEqual(late.data["distance"], 0.06)
+        self.assertEqual(
+            list(
+                Position.objects.filter(run=self.run)
+                .order_by("date_time")
+                .values_list("latitude", flat=True)
+            ),
+            [55.75, 55.7505, 55.752],
+        )
+
+    def test_flusher_writes_abandoned_runs(self):
+        buffer = get_position_buffer()
+        self.assertTrue(buffer._flusher.is_alive())
+        self.post_position(0, 55.75)
+        self.assertEqual(buffer.flush_expired(), 0)
+        buffer.max_age = 0
+        # what the flusher thread does when nothing else is posted
+        self.assertEqual(buffer.flush_expired(), 1)
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 1)
+        buffer.stop_flusher()
+        self.assertFalse(buffer._flusher.is_alive())
+
+    def test_flush_all(self):
+        self.post_position(0, 55.75)
+        self.assertEqual(get_position_buffer().flush_all(), 1)
+        self.assertEqual(Position.objects.count(), 1)
+
+    def test_expiry_is_left_to_the_flusher(self):
+        buffer = get_position_buffer()
+        buffer.max_age = 0
+        other = Run.objects.create(athlete=self.user, status=StatusChoices.IN_PROGRESS)
+        self.post_position(0, 55.75)
+        self.client.post(
+            "/api/positions/",
+            {
+                "run": other.id,
+                "latitude": 55.75,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+        )
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(buffer.flush_expired(), 2)
+
+    def test_runs_do_not_wait_for_each_other(self):
+        buffer = get_position_buffer()
+        other = Run.objects.create(athlete=self.user, status=StatusChoices.IN_PROGRESS)
+        busy = buffer.get_run(self.run.id)
+        locked, release = threading.Event(), threading.Event()
+
+        def slow_write():
+            # a long write of the first run
+            with busy.write_lock, busy.lock:
+                locked.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=slow_write)
+        thread.start()
+        locked.wait()
+        started = time.monotonic()
+        try:
+            buffer.add(
+                Position(
+                    run=other,
+                    latitude=55.75,
+                    longitude=37.61,
+                    date_time=datetime(2025, 10, 12, 10, 0, tzinfo=timezone.utc),
+                )
+            )
+            self.assertEqual(buffer.flush(other.id), 1)
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            release.set()
+            thread.join()
+
+
+@override_settings(COLLECTIBLES_PER_POSITION=False)
+class OutOfOrderPositionsTest(APITestCase):
+    """
+    Test case for late and repeated position uploads
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password123"
+        )
+        self.run = Run.objects.create(
+            athlete=self.user, status=StatusChoices.IN_PROGRESS
+        )
+
+    def post_position(self, second, latitude):
+        return self.client.post(
+            "/api/positions/",
+            {
+                "run": self.run.id,
+                "latitude": latitude,
+                "longitude": 37.61,
+                "date_time": f"2025-10-12T10:00:{second:02}.000000",
+            },
+        )
+
+    def get_chain(self):
+        return list(
+            Position.objects.filter(run=self.run)
+            .order_by("date_time")
+            .values_list("latitude", "speed", "distance")
+        )
+
+    def test_late_position_shifts_suffix(self):
+        for second, latitude in ((0, 55.75), (20, 55.752), (30, 55.753)):
+            self.post_position(second, latitude)
+        # same track uploaded in order
+        in_order = Run.objects.create(
+            athlete=self.user, status=StatusChoices.IN_PROGRESS
+        )
+        for second, latitude in ((0, 55.75), (10, 55.7505), (20, 55.752)):
+            self.client.post(
+                "/api/positions/",
+                {
+                    "run": in_order.id,
+                    "latitude": latitude,
+                    "longitude": 37.61,
+                    "date_time": f"2025-10-12T10:00:{second:02}.000000",
+                },
+            )
+
+        response = self.post_position(10, 55.7505)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["distance"], 0.06)
+        chain = self.get_chain()
+        expected = list(
+            Position.objects.filter(run=in_order)
+            .order_by("date_time")
+            .values_list("latitude", "speed", "distance")
+        )
+        self.assertEqual(chain[:3], expected)
+        self.assertAlmostEqual(chain[3][2], expected[2][2] + 0.11)
+
+    def test_stop_after_a_late_position(self):
+        for second, latitude in ((0, 55.75), (20, 55.77), (10, 55.76)):
+            self.post_position(second, latitude)
+        self.client.post(f"/api/runs/{self.run.id}/stop/")
+        self.run.refresh_from_db()
+        expected = geodesic((55.75, 37.61), (55.77, 37.61)).km
+        self.assertAlmostEqual(self.run.distance, expected, places=3)
+
+    def test_repeated_position(self):
+        first = self.post_position(0, 55.75)
+        second = self.post_position(0, 55.75)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data["id"], second.data["id"])
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 1)
+
+
+class CoachRatingTest(APITestCase):
+    """
+    Test case for the precomputed rating of coaches
+    """
+
+    def setUp(self):
+        self.coach = User.objects.create_user(username="coach", is_staff=True)
+        self.athletes = [
+            User.objects.create_user(username=f"athlete{i}") for i in range(2)
+        ]
+        for athlete in self.athletes:
+            self.client.post(
+                f"/api/subscribe_to_coach/{self.coach.id}/", {"athlete": athlete.id}
+            )
+
+    def rate(self, athlete, rating):
+        return self.client.post(
+            f"/api/rate_coach/{self.coach.id}/",
+            {"athlete": athlete.id, "rating": rating},
+        )
+
+    def get_rating(self):
+        response = self.client.get("/api/users/?type=coach")
+        return response.data[0]["rating"]
+
+    def test_subscribe_once(self):
+        response = self.client.post(
+            f"/api/subscribe_to_coach/{self.coach.id}/",
+            {"athlete": self.athletes[0].id},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Subscribe.objects.count(), 2)
+
+    def test_rating_and_rerating(self):
+        self.assertIsNone(self.get_rating())
+        self.assertEqual(self.rate(self.athletes[0], 5).status_code, 200)
+        self.rate(self.athletes[1], 2)
+        self.assertEqual(self.get_rating(), 3.5)
+        self.rate(self.athletes[0], 1)
+        self.assertEqual(self.get_rating(), 1.5)
+        stats = CoachStats.objects.get(coach=self.coach)
+        self.assertEqual((stats.rating_sum, stats.rating_count), (3, 2))
+
+    def test_rating_without_subscription(self):
+        athlete = User.objects.create_user(username="stranger")
+        response = self.rate(athlete, 5)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CoachStats.objects.exists())
+
+    def test_deleted_subscription(self):
+        self.rate(self.athletes[0], 5)
+        self.rate(self.athletes[1], 2)
+        Subscribe.objects.get(athlete=self.athletes[0]).delete()
+        self.assertEqual(self.get_rating(), 2)
+        self.coach.delete()
+        self.assertFalse(CoachStats.objects.exists())
+
+    def test_model_saves(self):
+        # admin and shell save the model instead of calling rate_coach
+        subscription = Subscribe.objects.get(athlete=self.athletes[0])
+        subscription.rating = 4
+        subscription.save()
+        subscription.rating = 2
+        subscription.save()
+        self.assertEqual(self.get_rating(), 2)
+        Subscribe.objects.create(
+            coach=self.coach,
+            athlete=User.objects.create_user(username="athlete2"),
+            rating=5,
+        )
+        self.assertEqual(self.get_rating(), 3.5)
+        other_coach = User.objects.create_user(username="other", is_staff=True)
+        subscription.coach = other_coach
+        subscription.save()
+        self.assertEqual(self.get_rating(), 5)
+        stats = CoachStats.objects.get(coach=other_coach)
+        self.assertEqual((stats.rating_sum, stats.rating_count), (2, 1))
+
+    def test_receivers_connected_at_setup(self):
+        code = (
+            "import django; django.setup(); "
+            "from django.db.models.signals import post_delete; "
+            "from app_run.models import Subscribe; "
+            "print(post_delete.has_listeners(Subscribe))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "project_run.settings.local"},
+            cwd=settings.BASE_DIR,
+        )
+        self.assertEqual(result.stdout.strip(), "True", result.stderr)
+
+
+class UserSearchWordsTest(APITestCase):
+    """
+    Test case for the normalized search by name
+    """
+
+    def setUp(self):
+        self.hedgehog = User.objects.create_user(
+            username="hedgehog", first_name="Ёжик", last_name="Туманов"
+        )
+        self.fog = User.objects.create_user(
+            username="fog", first_name="Туман", last_name="Ежов"
+        )
+
+    def search(self, term):
+        response = self.client.get("/api/users/", {"search": term})
+        return [user["id"] for user in response.data]
+
+    def test_case_and_yo_folding(self):
+        self.assertEqual(self.search("ЕЖИК"), [self.hedgehog.id])
+        self.assertEqual(self.search("ёжо"), [self.fog.id])
+
+    def test_exact_words_come_first(self):
+        self.assertEqual(self.search("туман"), [self.fog.id, self.hedgehog.id])
+        self.assertEqual(self.search("туман еж"), [self.fog.id, self.hedgehog.id])
+        self.assertEqual(self.search("тумано ежи"), [self.hedgehog.id])
+
+    def test_words_follow_the_name(self):
+        self.fog.last_name = "Ли"
+        self.fog.save()
+        self.assertEqual(self.search("ежов"), [])
+        self.assertEqual(self.search("ли"), [self.fog.id])
+        self.fog.save(update_fields=["last_login"])
+        self.assertEqual(self.search("ли"), [self.fog.id])
+
+
+class CachedCountPaginationTest(APITestCase):
+    """
+    Test case for the cached count of the paginated users list
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create_user(username="coach", is_staff=True)
+        self.athletes = [
+            User.objects.create_user(username=f"athlete{i}", first_name="Бегун")
+            for i in range(3)
+        ]
+        Run.objects.create(athlete=self.athletes[0], status=StatusChoices.FINISHED)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_count_without_annotations(self):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get("/api/users/?type=athlete&size=2")
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(len(response.data["results"]), 2)
+        count_sql = next(
+            query["sql"] for query in queries if "COUNT(*)" in query["sql"]
+        )
+        self.assertNotIn("app_run_run", count_sql)
+        self.assertNotIn("app_run_coachstats", count_sql)
+
+    def test_count_is_cached_per_filters(self):
+        self.client.get("/api/users/?type=athlete&size=2")
+        User.objects.create_user(username="late", first_name="Бегун")
+        response = self.client.get("/api/users/?type=athlete&size=2&page=2")
+        self.assertEqual(response.data["count"], 3)
+        response = self.client.get("/api/users/?size=2&search=бегун")
+        self.assertEqual(response.data["count"], 4)
+        response = self.client.get("/api/users/?size=2&type=coach")
+        self.assertEqual(response.data["count"], 1)
+
+
+class SparseFieldsetsTest(APITestCase):
+    """
+    Test case for ?fields= and ?omit= of the list endpoints
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="runner", first_name="Ёжик")
+        self.run = Run.objects.create(
+            athlete=self.user, comment="long comment", status=StatusChoices.FINISHED
+        )
+        Position.objects.create(
+            run=self.run,
+            latitude=55.75,
+            longitude=37.61,
+            date_time=datetime(2025, 10, 12, 10, 0, 0, tzinfo=timezone.utc),
+            speed=0,
+            distance=0,
+        )
+
+    def get(self, url):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, " ".join(query["sql"] for query in queries)
+
+    def test_runs(self):
+        data, sql = self.get("/api/runs/?fields=id,status")
+        self.assertEqual(data, [{"id": self.run.id, "status": "finished"}])
+        self.assertNotIn("comment", sql)
+        self.assertNotIn("auth_user", sql)
+
+        data, sql = self.get("/api/runs/?omit=athlete_data,comment")
+        self.assertNotIn("athlete_data", data[0])
+        self.assertIn("distance", data[0])
+        self.assertNotIn("auth_user", sql)
+
+    def test_users(self):
+        data, sql = self.get("/api/users/?fields=id,first_name,type")
+        self.assertEqual(
+            data, [{"id": self.user.id, "first_name": "Ёжик", "type": "athlete"}]
+        )
+        self.assertNotIn("app_run_run", sql)
+        self.assertNotIn("coachstats", sql)
+        self.assertNotIn("password", sql)
+
+        data, _ = self.get("/api/users/?omit=rating")
+        self.assertEqual(data[0]["runs_finished"], 1)
+        self.assertNotIn("rating", data[0])
+
+    def test_positions(self):
+        data, sql = self.get(f"/api/positions/?run={self.run.id}&fields=latitude")
+        self.assertEqual(data, [{"latitude": 55.75}])
+        self.assertNotIn("speed", sql)
+
+    def test_unknown_field(self):
+        response = self.client.get("/api/runs/?fields=id,secret")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", response.data["detail"])
+
+    def test_empty_selection(self):
+        for url in (
+            "/api/runs/?fields=",
+            "/api/users/?fields=",
+            "/api/users/?fields=,",
+            f"/api/positions/?run={self.run.id}&fields=latitude&omit=latitude",
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+
+
+class RunRollupTest(APITestCase):
+    """
+    Test case for weekly and monthly rollups of finished runs
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="runner")
+        self.runs = []
+        # Wednesday, Friday and Monday of the next week, the last one in March
+        for day, distance, seconds in ((26, 5, 1800), (28, 10, 3000), (31, 2, 600)):
+            run = Run.objects.create(athlete=self.user, status=StatusChoices.FINISHED)
+            Run.objects.filter(id=run.id).update(
+                created_at=datetime(2025, 3, day, 8, 0, tzinfo=timezone.utc),
+                distance=distance,
+                run_time_seconds=seconds,
+                speed=round(distance * 1000 / seconds, 2),
+            )
+            run.refresh_from_db()
+            rollups.add_run(run)
+
+    def get_history(self, period):
+        response = self.client.get(
+            f"/api/history/{self.user.id}/",
+            {"period": period, "from": "2025-03-01", "to": "2025-04-30"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_weeks(self):
+        with self.assertNumQueries(2):
+            # the athlete and one range query
+            weeks = self.get_history("week")
+        self.assertEqual(
+            [(week["start"], week["runs"], week["distance"]) for week in weeks],
+            [("2025-03-24", 2, 15), ("2025-03-31", 1, 2)],
+        )
+        self.assertEqual(weeks[0]["best_speed"], 3.33)
+        self.assertEqual(weeks[0]["avg_speed"], 3.12)
+
+    def test_months_and_rebuild(self):
+        months = self.get_history("month")
+        self.assertEqual(len(months), 1)
+        self.assertEqual(months[0]["run_time_seconds"], 5400)
+        RunRollup.objects.update(runs=0)
+        out = io.StringIO()
+        call_command("rebuild_rollups", stdout=out)
+        self.assertIn("3 rollups rebuilt", out.getvalue())
+        self.assertEqual(self.get_history("month"), months)
+
+    def test_stop_adds_run(self):
+        run = Run.objects.create(athlete=self.user, status=StatusChoices.IN_PROGRESS)
+        self.client.post(f"/api/runs/{run.id}/stop/")
+        # the week of March 31 and the current week and month
+        self.assertEqual(RunRollup.objects.filter(athlete=self.user, runs=1).count(), 3)
+
+    def test_wrong_period(self):
+        response = self.client.get(f"/api/history/{self.user.id}/?period=year")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ColdStartTest(APITestCase):
+    """
+    Test case for the import time of a cold start
+    """
+
+    # a few times the measured time, it catches new heavy imports
+    import_budget_ms = 2000
+    app_budget_ms = 250
+
+    def test_import_budget(self):
+        imports = profile_imports()
+        names = {name for name, _, _ in imports}
+        self.assertNotIn("openpyxl", names)
+        self.assertNotIn("geopy", names)
+        total_ms = sum(self_us for _, self_us, _ in imports) / 1000
+        app_ms = sum(
+            self_us for name, self_us, _ in imports if name.startswith("app_run")
+        )
+        self.assertLess(total_ms, self.import_budget_ms)
+        self.assertLess(app_ms / 1000, self.app_budget_ms)
+
+    def test_warm_up(self):
+        timings = warm_up()
+        self.assertEqual(list(timings), ["urls", "serializers", "databases", "modules"])
+        self.assertIn("geopy.distance", sys.modules)
+        self.assertNotIn("openpyxl", PRELOADED_MODULES)
+
+
+class MetricsTest(APITestCase):
+    """
+    Test case for the Prometheus metrics
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="runner")
+        self.run = Run.objects.create(
+            athlete=self.user, status=StatusChoices.IN_PROGRESS
+        )
+
+    def get_value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    @override_settings(DEBUG=True)
+    def test_request_metrics(self):
+        self.client.get("/api/users/")
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{method="GET"', body)
+        self.assertIn("http_request_db_queries_bucket", body)
+        self.assertIn('cache_requests_total{cache="geodesic"', body)
+        self.assertGreater(
+            self.get_value(
+                "http_request_db_queries_sum", method="GET", route="api/users/$"
+            ),
+            0,
+        )
+
+    def test_business_counters(self):
+        before = {
+            "positions": self.get_value(
+                "positions_ingested_total", endpoint="positions"
+            ),
+            "runs": self.get_value("runs_finished_total"),
+            "challenges": self.get_value("challenge_awards_total"),
+            "awards": self.get_value("collectible_awards_total", source="position"),
+        }
+        CollectibleItem.objects.create(
+            name="item",
+            uid="item",
+            latitude=55.75,
+            longitude=37.61,
+            picture="https://example.com/item.png",
+            value=1,
+        )
+        self.client.post(
+            "/api/positions/",
+            {
+                "run": self.run.id,
+                "latitude": 55.75,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+        )
+        Challenge.objects.create(athlete=self.user, full_name="test")
+        self.client.post(f"/api/runs/{self.run.id}/stop/")
+        after = {
+            "positions": self.get_value(
+                "positions_ingested_total", endpoint="positions"
+            ),
+            "runs": self.get_value("runs_finished_total"),
+            "challenges": self.get_value("challenge_awards_total"),
+            "awards": self.get_value("collectible_awards_total", source="position"),
+        }
+        for name in before:
+            self.assertEqual(after[name] - before[name], 1, name)
+
+    @override_settings(DEBUG=True)
+    def test_async_chain_is_not_adapted(self):
+        # Django logs every adaptation in DEBUG mode
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    async def test_async_request_queries(self):
+        route = "api/positions/ingest/"
+        before = self.get_value(
+            "http_request_db_queries_sum", method="POST", route=route
+        )
+        response = await self.async_client.post(
+            "/api/positions/ingest/",
+            {
+                "run": self.run.id,
+                "latitude": 55.75,
+                "longitude": 37.61,
+                "date_time": "2025-10-12T10:00:00.000000",
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        await wait_side_effects()
+        after = self.get_value(
+            "http_request_db_queries_sum", method="POST", route=route
+        )
+        self.assertGreater(after - before, 0)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(
+            "/api/metrics/", headers={"Authorization": "Bearer secret"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_closed_without_token(self):
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_concurrent_scrapes(self):
+        cache_clear()
+        record_distance_cache()
+        before = self.get_value("cache_requests_total", cache="geodesic", result="miss")
+        for latitude in range(100):
+            distance_m((latitude / 100, 37.61), (55.75, 37.61))
+        threads = [threading.Thread(target=record_distance_cache) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        after = self.get_value("cache_requests_total", cache="geodesic", result="miss")
+        self.assertEqual(after - before, 100)
+
+
+class RequestProfilerTest(APITestCase):
+    """
+    Test case for the on-demand request profiler
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        overrides = override_settings(PROFILER_DIR=self.directory.name, PROFILER_KEEP=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+        self.client.force_login(self.staff)
+
+    def test_deterministic_profile(self):
+        response = self.client.get("/api/users/?profile=1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = RequestProfile.objects.get(id=response["X-Profile-Id"])
+        self.assertEqual(profile.route, "api/users/$")
+        self.assertEqual(profile.user, self.staff)
+        self.assertGreater(profile.queries, 0)
+        directory = get_directory(profile)
+        self.assertTrue((directory / PSTATS_FILE).exists())
+        queries = json.loads((directory / QUERIES_FILE).read_text())
+        self.assertEqual(len(queries), profile.queries)
+        self.assertTrue(any(query["caller"] for query in queries))
+
+    def test_sampling_profile(self):
+        response = self.client.get("/api/users/", headers={"X-Profile": "sample"})
+        profile = RequestProfile.objects.get(id=response["X-Profile-Id"])
+        self.assertEqual(profile.profiler, "sample")
+        self.assertTrue((get_directory(profile) / STACKS_FILE).exists())
+
+    async def test_async_profile(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.post(
+            "/api/positions/ingest/?profile=sample", {}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        profile = await RequestProfile.objects.aget(id=response["X-Profile-Id"])
+        self.assertEqual(profile.profiler, "sample")
+
+    def test_concurrent_deterministic_profile(self):
+        # the process wide profiler is taken by another request or tool
+        with profiling._deterministic:
+            response = self.client.get("/api/users/?profile=1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = RequestProfile.objects.get(id=response["X-Profile-Id"])
+        self.assertEqual(profile.profiler, "sample")
+
+        other = cProfile.Profile()
+        other.enable()
+        try:
+            response = self.client.get("/api/users/?profile=1")
+        finally:
+            other.disable()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = RequestProfile.objects.get(id=response["X-Profile-Id"])
+        self.assertEqual(profile.profiler, "sample")
+        self.assertFalse(profiling._deterministic.locked())
+
+    def test_only_staff(self):
+        self.client.force_login(User.objects.create_user(username="runner"))
+        response = self.client.get("/api/users/?profile=1")
+        self.assertNotIn("X-Profile-Id", response)
+        self.client.logout()
+        response = self.client.get("/api/users/?profile=1")
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_old_profiles_removed(self):
+        ids = [
+            self.client.get("/api/users/?profile=1")["X-Profile-Id"] for _ in range(3)
+        ]
+        self.assertEqual(
+            sorted(RequestProfile.objects.values_list("id", flat=True)),
+            [int(id) for id in ids[1:]],
+        )
+        self.assertFalse(Path(self.directory.name, ids[0]).exists())
+
+    def test_admin_listing(self):
+        self.client.get("/api/users/?profile=1")
+        self.client.force_login(User.objects.create_superuser(username="admin"))
+        response = self.client.get("/admin/app_run/requestprofile/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "/api/users/?profile=1")
+
+
+class CoachDashboardTest(APITestCase):
+    """
+    Test case for the coach dashboard
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create_user(username="coach", is_staff=True)
+        self.athletes = []
+        for number in range(3):
+            self.add_athlete(f"athlete{number}")
+        self.url = f"/api/coach_dashboard/{self.coach.id}/"
+
+    def add_athlete(self, username):
+        athlete = User.objects.create_user(username=username)
+        Subscribe.objects.create(coach=self.coach, athlete=athlete, rating=4)
+        for day in range(3):
+            Run.objects.create(
+                athlete=athlete,
+                status=StatusChoices.FINISHED,
+                distance=5,
+                run_time_seconds=1800,
+                speed=2.5 + day,
+            )
+        Run.objects.create(athlete=athlete, status=StatusChoices.IN_PROGRESS)
+        Challenge.objects.create(athlete=athlete, full_name="Сделай 10 Забегов!")
+        self.athletes.append(athlete)
+        return athlete
+
+    def get_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_dashboard(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["coach"]["id"], self.coach.id)
+        self.assertEqual(response.data["count"], 3)
+        athlete = response.data["results"][0]
+        self.assertEqual(athlete["id"], self.athletes[0].id)
+        self.assertEqual(athlete["rating"], 4)
+        self.assertEqual(athlete["runs_finished"], 3)
+        self.assertEqual(athlete["total_distance"], 15)
+        self.assertEqual(athlete["total_run_time_seconds"], 5400)
+        self.assertEqual(athlete["best_speed"], 4.5)
+        self.assertEqual(len(athlete["recent_runs"]), 3)
+        self.assertEqual(athlete["challenges"], ["Сделай 10 Забегов!"])
+
+    @override_settings(COACH_DASHBOARD_RECENT_RUNS=2)
+    def test_fixed_number_of_queries(self):
+        queries = self.get_queries()
+        for number in range(3, 6):
+            self.add_athlete(f"athlete{number}")
+        self.assertEqual(self.get_queries(), queries)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data["results"][0]["recent_runs"]), 2)
+
+    def test_pagination(self):
+        response = self.client.get(self.url, {"size": 2, "page": 2})
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(
+            [athlete["id"] for athlete in response.data["results"]],
+            [self.athletes[2].id],
+        )
+
+    def test_cache_invalidated_by_stop(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+
+        run = Run.objects.filter(status=StatusChoices.IN_PROGRESS).first()
+        self.client.post(f"/api/runs/{run.id}/stop/")
+        response = self.client.get(self.url)
+        athlete = next(
+            athlete
+            for athlete in response.data["results"]
+            if athlete["id"] == run.athlete_id
+        )
+        self.assertEqual(athlete["runs_finished"], 4)
+
+    def test_cache_invalidated_by_subscription(self):
+        self.client.get(self.url)
+        self.add_athlete("new")
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["count"], 4)
+
+    def test_not_a_coach(self):
+        response = self.client.get(f"/api/coach_dashboard/{self.athletes[0].id}/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/coach_dashboard/0/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -2,11 +2,18 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from app_run.views import (
     get_company_details,
+    get_metrics,
+    distance_cache_stats,
     RunViewSet,
     UserViewSet,
     StartRunView,
     StopRunView,
+    RunSplitsView,
+    PersonalBestsView,
+    RunHistoryView,
+    CoachDashboardView,
     AthleteInfoView,
+    HeatmapView,
     ChallengesViewSet,
     PositionViewSet,
     CollectibleItemViewSet,
@@ -15,6 +22,8 @@ from app_run.views import (
     ChallengesListView,
     rate_coach,
     analytics_for_coach,
+    ingest_position,
+    live_positions,
 )
 
 router = DefaultRouter()
@@ -26,8 +35,21 @@ router.register("collectible_item", CollectibleItemViewSet, basename="collectibl
 
 urlpatterns = [
     path("company_details/", get_company_details, name="get_company_details"),
+    path("distance_cache/", distance_cache_stats, name="distance_cache_stats"),
+    path("metrics/", get_metrics, name="metrics"),
     path("runs/<int:id>/start/", StartRunView.as_view(), name="start_run"),
     path("runs/<int:id>/stop/", StopRunView.as_view(), name="stop_run"),
+    path("runs/<int:id>/splits/", RunSplitsView.as_view(), name="run_splits"),
+    path(
+        "personal_bests/<int:id>/", PersonalBestsView.as_view(), name="personal_bests"
+    ),
+    path("history/<int:id>/", RunHistoryView.as_view(), name="run_history"),
+    path(
+        "coach_dashboard/<int:coach_id>/",
+        CoachDashboardView.as_view(),
+        name="coach_dashboard",
+    ),
+    path("heatmap/", HeatmapView.as_view(), name="heatmap"),
     path("athlete_info/<int:id>/", AthleteInfoView.as_view(), name="athlete_info"),
     path("upload_file/", upload_collectible_items, name="upload_file"),
     path("subscribe_to_coach/<int:id>/", subscribe_to_coach, name="subscribe_to_coach"),
@@ -40,5 +62,7 @@ urlpatterns = [
         analytics_for_coach,
         name="analytics_for_coach",
     ),
+    path("runs/<int:id>/live/", live_positions, name="live_positions"),
+    path("positions/ingest/", ingest_position, name="ingest_position"),
     path("", include(router.urls)),
 ]
@@ -1,4 +1,14 @@
+import math
+
+from django.db import transaction
+from django.db.models import F
 from rest_framework import serializers
+from .distance import distance_km, distance_m
+from .models import CollectibleItem, Position, Run
+
+# an item is collected when the runner passes closer than this
+COLLECT_RADIUS_KM = 0.1
+KM_PER_DEGREE = 111.32
 
 
 def validate_latitude(value):
@@ -28,3 +38,229 @@ def validate_longitude(value):
 def count_decimal_digits(number):
     s = str(number)
     return len(s) - s.find(".") - 1 if "." in s else 0
+
+
+def get_speed_and_distance(last_position, latitude, longitude, date_time):
+    """
+    Returns speed (meters per second) and cumulative distance (km)
+    for a new point based on the previous position of the run.
+    """
+    if not last_position:
+        return 0, 0
+    last_point = (last_position.latitude, last_position.longitude)
+    meters = distance_m((latitude, longitude), last_point)
+    return get_speed_and_distance_for_meters(last_position, meters, date_time)
+
+
+def get_speed_and_distance_for_meters(last_position, distance_m, date_time):
+    """
+    Same as get_speed_and_distance when the segment length is already known.
+    """
+    # calc speed v = s / t
+    # s – distance, а t – time
+    # our task is to get in meters per seconds
+    delta_t = (date_time - last_position.date_time).total_seconds()
+    speed = distance_m / delta_t if delta_t > 0 else 0
+    distance = last_position.distance + round(distance_m / 1000, 2)
+    return round(speed, 2), distance
+
+
+def save_position(position):
+    """
+    Saves a new position of the run, fixes may arrive late or twice.
+    Writes of one run are serialized by a lock on the run row.
+    A fix of a moment which is already stored returns the stored position.
+    A late fix is chained after its predecessor in time: the next position
+    gets new speed and distance and the rest are shifted by the same
+    distance with one UPDATE, earlier positions are not touched.
+    Returns the position and whether it was created.
+    """
+    with transaction.atomic():
+        Run.objects.select_for_update().only("id").get(id=position.run_id)
+        positions = Position.objects.filter(run_id=position.run_id)
+        stored = positions.filter(date_time=position.date_time).first()
+        if stored:
+            return stored, False
+
+        last_position = (
+            positions.filter(date_time__lt=position.date_time)
+            .order_by("-date_time", "-id")
+            .first()
+        )
+        position.speed, position.distance = get_speed_and_distance(
+            last_position, position.latitude, position.longitude, position.date_time
+        )
+        position.save()
+
+        following = positions.filter(date_time__gt=position.date_time)
+        next_position = following.order_by("date_time", "id").first()
+        if next_position:
+            old_distance = next_position.distance or 0
+            next_position.speed, next_position.distance = get_speed_and_distance(
+                position,
+                next_position.latitude,
+                next_position.longitude,
+                next_position.date_time,
+            )
+            next_position.save(update_fields=["speed", "distance"])
+            shift = next_position.distance - old_distance
+            if shift:
+                following.exclude(id=next_position.id).update(
+                    distance=F("distance") + shift
+                )
+    return position, True
+
+
+def award_collectible_items(latitude, longitude, athlete):
+    """
+    Adds to the athlete every collectible item closer than 0.1 km
+    to the given point.
+    """
+    # radius of search is 0.1 km. Approx 0.001 degree
+    delta = 0.001
+
+    # find collectible items that are close to the position of the runner
+    collectible_items = CollectibleItem.objects.filter(
+        latitude__range=(latitude - delta, latitude + delta),
+        longitude__range=(longitude - delta, longitude + delta),
+    )
+
+    for item in collectible_items:
+        if validate_latitude(item.latitude) and validate_longitude(item.longitude):
+            desirable = (item.latitude, item.longitude)
+            difference = distance_km((latitude, longitude), desirable)
+            if difference < COLLECT_RADIUS_KM:
+                item.users.add(athlete)
+
+
+def segment_distance_km(point, start, finish):
+    """
+    Distance from the point to the segment between start and finish.
+    Coordinates are projected to a plane around the point,
+    which is precise enough at the scale of the collect radius.
+    """
+    scale = math.cos(math.radians(point[0]))
+    ax = (start[1] - point[1]) * scale
+    ay = start[0] - point[0]
+    bx = (finish[1] - point[1]) * scale
+    by = finish[0] - point[0]
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    # share of the segment where it is closest to the point
+    share = 0 if length == 0 else min(max(-(ax * dx + ay * dy) / length, 0), 1)
+    return math.hypot(ax + share * dx, ay + share * dy) * KM_PER_DEGREE
+
+
+def sweep_collectible_items(run):
+    """
+    Adds to the athlete every collectible item closer than COLLECT_RADIUS_KM
+    to any segment of the track, so items between two sparse fixes
+    are collected as well.
+    Candidates come from one query over the bounding box of the track,
+    the new items are added with one insert.
+    """
+    points = list(
+        Position.objects.filter(run=run)
+        .order_by("date_time", "id")
+        .values_list("latitude", "longitude")
+    )
+    if not points:
+        return []
+    latitudes = [latitude for latitude, _ in points]
+    longitudes = [longitude for _, longitude in points]
+    lat_delta = COLLECT_RADIUS_KM / KM_PER_DEGREE
+    widest = max(abs(min(latitudes)), abs(max(latitudes))) + lat_delta
+    lon_delta = lat_delta / max(math.cos(math.radians(min(widest, 89.9))), 0.01)
+    candidates = (
+        CollectibleItem.objects.filter(
+            latitude__range=(min(latitudes) - lat_delta, max(latitudes) + lat_delta),
+            longitude__range=(
+                min(longitudes) - lon_delta,
+                max(longitudes) + lon_delta,
+            ),
+        )
+        .exclude(users=run.athlete_id)
+        .values_list("id", "latitude", "longitude")
+    )
+    # a track of one fix is a segment of zero length
+    segments = list(zip(points, points[1:])) or [(points[0], points[0])]
+
+    collected = []
+    for item_id, latitude, longitude in candidates:
+        for start, finish in segments:
+            # cheap box check before the projection
+            if (
+                min(start[0], finish[0]) - lat_delta > latitude
+                or max(start[0], finish[0]) + lat_delta < latitude
+                or min(start[1], finish[1]) - lon_delta > longitude
+                or max(start[1], finish[1]) + lon_delta < longitude
+            ):
+                continue
+            if segment_distance_km((latitude, longitude), start, finish) < (
+                COLLECT_RADIUS_KM
+            ):
+                collected.append(item_id)
+                break
+
+    Through = CollectibleItem.users.through
+    Through.objects.bulk_create(
+        [
+            Through(collectibleitem_id=item_id, user_id=run.athlete_id)
+            for item_id in collected
+        ],
+        ignore_conflicts=True,
+    )
+    return collected
+
+
+def get_track_points(track):
+    """
+    (seconds from start, cumulative km) of a track given as
+    (date_time, speed, km from the previous position) in time order.
+    Positions without time add their distance but no point.
+    """
+    points = []
+    total = 0
+    for date_time, _, segment in track:
+        total += segment
+        if date_time is None:
+            continue
+        if not points:
+            start = date_time
+        points.append(((date_time - start).total_seconds(), total))
+    return points
+
+
+def get_splits(points):
+    """
+    Seconds of every full kilometre.
+    points are (seconds from start, cumulative km) sorted by time,
+    the moment a kilometre is crossed is interpolated between two points.
+    """
+    splits = []
+    km = 1
+    last_crossing = points[0][0] if points else 0
+    for (t0, d0), (t1, d1) in zip(points, points[1:]):
+        while d0 < km <= d1:
+            crossing = t0 + (t1 - t0) * (km - d0) / (d1 - d0)
+            splits.append(round(crossing - last_crossing, 2))
+            last_crossing = crossing
+            km += 1
+    return splits
+
+
+def get_best_effort(points, distance):
+    """
+    Shortest time to cover distance km, None if the run is shorter.
+    Two pointers over (seconds from start, cumulative km):
+    for every end the latest start which still covers the distance is kept.
+    """
+    best = None
+    start = 0
+    for end in range(len(points)):
+        while start < end and points[end][1] - points[start + 1][1] >= distance:
+            start += 1
+        if points[end][1] - points[start][1] >= distance:
+            elapsed = points[end][0] - points[start][0]
+            best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -1,8 +1,22 @@
-from rest_framework.decorators import api_view
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+from functools import cached_property, partial
+
+from asgiref.sync import sync_to_async
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils import timezone
+from django.db import IntegrityError, connections, transaction
 from rest_framework import viewsets
 from rest_framework.views import APIView
 from .models import (
@@ -13,6 +27,11 @@ from .models import (
     Position,
     CollectibleItem,
     Subscribe,
+    Split,
+    BestEffort,
+    EffortChoices,
+    PeriodChoices,
+    RunRollup,
 )
 from .serializers import (
     RunSerializer,
@@ -23,26 +42,61 @@ from .serializers import (
     AthleteSerializerExtended,
     CoachSerializerExtended,
     TotalChallengesSerializer,
+    AsyncPositionSerializer,
+    ValuesSerializer,
+    SplitSerializer,
+    BestEffortSerializer,
+    RunRollupSerializer,
+    DashboardAthleteSerializer,
 )
 from django.contrib.auth.models import User
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_POST
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import (
     Count,
     Q,
     Sum,
     Max,
-    Min,
     Avg,
+    F,
+    FloatField,
+    Window,
 )
-from geopy.distance import geodesic
-from openpyxl import load_workbook
-from .utils import validate_latitude, validate_longitude
-from datetime import timedelta
+from django.db.models.functions import Cast, Floor, Lag, NullIf
+from .db_routers import read_from_replica
+from .renderers import ORJSONResponse
+from .distance import cache_info, distance_km
+from .functions import Epoch, haversine_km
+from . import dashboard, heatmap, rollups
+from .metrics import (
+    COLLECTIBLE_AWARDS,
+    POSITIONS_INGESTED,
+    RUNS_FINISHED,
+    XLSX_ROWS,
+    count_cache,
+    exposition,
+)
+from .ratings import change_rating
+from .search import UserSearchFilter
+from .buffer import get_position_buffer
+from .nearby import collectible_index
+from .live import finished_message, format_event, get_broker, position_message
+from .utils import (
+    award_collectible_items,
+    get_best_effort,
+    get_splits,
+    get_track_points,
+    save_position,
+    sweep_collectible_items,
+)
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from collections import defaultdict
 
+logger = logging.getLogger(__name__)
+
 
 @api_view(["GET"])
 def get_company_details(request):
@@ -52,12 +106,166 @@ def get_company_details(request):
     return Response(settings.COMPANY_INFORMATION)
 
 
+@require_GET
+def get_metrics(request):
+    """
+    Metrics in the Prometheus text format.
+    Requires "Authorization: Bearer <METRICS_TOKEN>", without the token
+    the metrics are served only in DEBUG mode.
+    """
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        data = {"detail": "METRICS_TOKEN is not set"}
+        return ORJSONResponse(data, status=status.HTTP_403_FORBIDDEN)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        data = {"detail": "Invalid metrics token"}
+        return ORJSONResponse(data, status=status.HTTP_403_FORBIDDEN)
+    body, content_type = exposition()
+    return HttpResponse(body, content_type=content_type)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def distance_cache_stats(request):
+    """
+    Hit rate of the geodesic distance cache, for monitoring.
+    """
+    return Response(cache_info())
+
+
 class AppPagination(PageNumberPagination):
     page_size_query_param = "size"
     max_page_size = 50
 
 
-class RunViewSet(viewsets.ModelViewSet):
+class CountedPaginator(Paginator):
+    """
+    Paginator which gets the number of objects from count_function.
+    """
+
+    def __init__(self, object_list, per_page, count_function, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_function = count_function
+
+    @cached_property
+    def count(self):
+        return self.count_function()
+
+
+class CachedCountPagination(AppPagination):
+    """
+    Counts the queryset of view.get_count_queryset(), the same rows
+    without the expensive annotations, and caches the count
+    per query for PAGINATION_COUNT_CACHE_SECONDS.
+    On PostgreSQL counts above PAGINATION_ESTIMATE_COUNT_OVER
+    are taken from the planner estimate.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        get_count_queryset = getattr(view, "get_count_queryset", None)
+        count_queryset = get_count_queryset() if get_count_queryset else queryset
+        self.django_paginator_class = partial(
+            CountedPaginator, count_function=lambda: self.get_count(count_queryset)
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        queryset = queryset.order_by()
+        sql, params = queryset.query.sql_with_params()
+        key = "count:" + hashlib.md5(repr((sql, params)).encode()).hexdigest()
+        count = cache.get(key)
+        count_cache("pagination_count", count is not None)
+        if count is None:
+            count = self.get_estimated_count(queryset, sql, params)
+            if count is None:
+                count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_SECONDS)
+        return count
+
+    def get_estimated_count(self, queryset, sql, params):
+        threshold = settings.PAGINATION_ESTIMATE_COUNT_OVER
+        connection = connections[queryset.db]
+        if threshold is None or connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]["Plan"]["Plan Rows"]
+        return estimate if estimate > threshold else None
+
+
+class SparseFieldsetsMixin:
+    """
+    ?fields=a,b keeps only these fields of the list, ?omit=c drops them.
+    The serializer must use SparseFieldsMixin.
+    Views read the kept fields with get_sparse_fields()
+    to fetch only the columns and joins they need.
+    """
+
+    def get_sparse_fields(self):
+        """
+        Names of the kept fields in the order of the serializer,
+        None when the whole serializer is used.
+        """
+        if hasattr(self, "_sparse_fields"):
+            return self._sparse_fields
+        self._sparse_fields = None
+        params = self.request.query_params
+        if self.action != "list" or not ("fields" in params or "omit" in params):
+            return None
+
+        names = list(self.get_serializer_class()().fields)
+        requested = {
+            param: [name for name in params[param].split(",") if name]
+            for param in ("fields", "omit")
+            if param in params
+        }
+        unknown = [
+            name for value in requested.values() for name in value if name not in names
+        ]
+        if unknown:
+            raise ParseError(
+                f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(names)}"
+            )
+        kept = requested.get("fields", names)
+        omitted = requested.get("omit", [])
+        fields = tuple(name for name in names if name in kept and name not in omitted)
+        if not fields:
+            # ?fields= or omitting everything would list empty objects
+            raise ParseError(f"No fields selected. Available: {', '.join(names)}")
+        self._sparse_fields = fields
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs["fields"] = fields
+        return super().get_serializer(*args, **kwargs)
+
+
+class ValuesListMixin(SparseFieldsetsMixin):
+    """
+    Serves list action from values_list() rows instead of model instances.
+    Only columns used by the serializer are fetched,
+    the output is the same as the one of serializer_class.
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer = ValuesSerializer.for_class(
+            self.get_serializer_class(), self.get_sparse_fields()
+        )
+        queryset = self.filter_queryset(self.get_queryset()).values_list(
+            *serializer.lookups
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+class RunViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing and editing run instances.
     There is also additional fetch for User Model via select_related through
@@ -73,7 +281,11 @@ class RunViewSet(viewsets.ModelViewSet):
     pagination_class = AppPagination
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class CoachDashboardPagination(AppPagination):
+    page_size = 20
+
+
+class UserViewSet(SparseFieldsetsMixin, viewsets.ReadOnlyModelViewSet):
     """
     A viewset is for read only. It allows to see users.
     It accepts Query Parameters:
@@ -86,31 +298,64 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     The viewSet does not show superusers.
 
     Additionally viewSet allows to search users by first_name
-    or last_name.
+    or last_name, see UserSearchFilter.
     """
 
-    queryset = User.objects.exclude(is_superuser=True).annotate(
-        runs_finished_count=Count(
-            "run",
-            filter=Q(run__status=StatusChoices.FINISHED),
-        ),
-        avg_rating=Avg("coach__rating"),
-    )
+    read_from_replica = True
+    # annotations needed by the fields of the serializer
+    annotations = {
+        "runs_finished": {
+            "runs_finished_count": Count(
+                "run",
+                filter=Q(run__status=StatusChoices.FINISHED),
+            )
+        },
+        # precomputed by rate_coach, no join to the subscriptions
+        "rating": {
+            "avg_rating": Cast("coach_stats__rating_sum", FloatField())
+            / NullIf("coach_stats__rating_count", 0)
+        },
+    }
+    # columns needed by the fields which are not model fields
+    sparse_requires = {"type": ["is_staff"]}
+    queryset = User.objects.exclude(is_superuser=True)
     serializer_class = UserSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ["first_name", "last_name"]
+    # search goes last, it ranks results before the ordering
+    filter_backends = [OrderingFilter, UserSearchFilter]
     ordering = ["id"]
     ordering_fields = ["date_joined"]
-    pagination_class = AppPagination
+    pagination_class = CachedCountPagination
 
     def get_queryset(self):
+        queryset = self.queryset
+        fields = self.get_sparse_fields()
+        for name, annotation in self.annotations.items():
+            if fields is None or name in fields:
+                queryset = queryset.annotate(**annotation)
+        if fields is not None:
+            queryset = queryset.only(*self.get_only_fields(fields))
+        return self.filter_type(queryset)
+
+    def get_only_fields(self, fields):
+        serializer_fields = self.get_serializer_class()().fields
+        model_fields = {field.name for field in User._meta.concrete_fields}
+        only = []
+        for name in fields:
+            only.extend(self.sparse_requires.get(name, []))
+            source = serializer_fields[name].source_attrs[:1]
+            only.extend(attr for attr in source if attr in model_fields)
+        return only
+
+    def get_count_queryset(self):
+        # same filters, without the joins of the annotations
+        return self.filter_queryset(self.filter_type(self.queryset))
+
+    def filter_type(self, queryset):
         param_type = self.request.query_params.get("type")
         if param_type == "coach":
-            queryset = self.queryset.filter(is_staff=True)
+            queryset = queryset.filter(is_staff=True)
         elif param_type == "athlete":
-            queryset = self.queryset.filter(is_staff=False)
-        else:
-            queryset = self.queryset
+            queryset = queryset.filter(is_staff=False)
         return queryset
 
     def get_serializer_class(self):
@@ -136,11 +381,11 @@ class StartRunView(APIView):
             or run.status == StatusChoices.FINISHED
         ):
             data = {"status": "bad_request"}
-            return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
         run.status = StatusChoices.IN_PROGRESS
         run.save()
         data = {"status": "success"}
-        return JsonResponse(data, status=status.HTTP_200_OK)
+        return ORJSONResponse(data, status=status.HTTP_200_OK)
 
 
 class StopRunView(APIView):
@@ -158,10 +403,25 @@ class StopRunView(APIView):
     def post(self, request, id):
         run = get_object_or_404(Run.objects.select_related("athlete"), id=id)
         # Check that run status is not INIT nor FINISHED
-        self.check_correct_status(run)
+        response = self.check_correct_status(run)
+        if response is not None:
+            return response
+        if settings.POSITION_WRITE_BEHIND:
+            buffer = get_position_buffer()
+            buffer.flush(run.id)
+            buffer.forget(run.id)
         run.status = StatusChoices.FINISHED
+        # every segment is measured once for the totals, splits and best efforts
+        track = self.get_track(run)
         # get total km and run_time_seconds
-        distance, result_time = self.get_total_km(run)
+        distance, result_time = self.get_total_km(run, track)
+        self.save_splits(run, track)
+        heatmap.add_run(run)
+        rollups.add_run(run)
+        RUNS_FINISHED.inc()
+        if settings.COLLECTIBLES_SWEEP_AT_STOP:
+            collected = sweep_collectible_items(run)
+            COLLECTIBLE_AWARDS.labels("sweep").inc(len(collected))
         if not self.has_challenge(
             run.athlete, self.challenge_name_2_km
         ) and self.check_2km_10min(distance, result_time):
@@ -176,8 +436,10 @@ class StopRunView(APIView):
                 athlete=run.athlete, full_name=self.challenge_name_10_runs
             )
         self.calculate_total_distance(run.athlete)
+        dashboard.invalidate_athlete(run.athlete_id)
+        get_broker().publish(run.id, finished_message())
         data = {"status": "success"}
-        return JsonResponse(data, status=status.HTTP_200_OK)
+        return ORJSONResponse(data, status=status.HTTP_200_OK)
 
     def has_ten_runs(self, user):
         runs_count = Run.objects.filter(
@@ -201,31 +463,71 @@ class StopRunView(APIView):
     def check_correct_status(self, run):
         if run.status == StatusChoices.INIT or run.status == StatusChoices.FINISHED:
             data = {"status": "bad_request"}
-            return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+    def get_track(self, run):
+        """
+        (date_time, speed, km from the previous position) of every position
+        of the run in the time order of save_position.
+        """
+        if settings.TRACK_LENGTH_IN_DATABASE:
+            return self.get_track_in_database(run)
+        return self.get_geodesic_track(run)
+
+    def get_geodesic_track(self, run):
+        rows = (
+            Position.objects.filter(run=run)
+            .order_by("date_time", "id")
+            .values_list("date_time", "speed", "latitude", "longitude")
+        )
+        track = []
+        last_point = None
+        for date_time, speed, latitude, longitude in rows:
+            point = (latitude, longitude)
+            segment = distance_km(last_point, point) if last_point else 0
+            track.append((date_time, speed, segment))
+            last_point = point
+        return track
+
+    def get_track_in_database(self, run):
+        """
+        Same track, but the segments are measured by the database:
+        LAG() gives the previous point of every position and the segment
+        is measured with the haversine formula.
+        Coordinates are not sent back.
+        """
+        order_by = [F("date_time").asc(), F("id").asc()]
+        rows = (
+            Position.objects.filter(run=run)
+            .annotate(
+                segment=haversine_km(
+                    Window(Lag("latitude"), order_by=order_by),
+                    Window(Lag("longitude"), order_by=order_by),
+                    F("latitude"),
+                    F("longitude"),
+                )
+            )
+            .order_by("date_time", "id")
+            .values_list("date_time", "speed", "segment")
+        )
+        # the first position has no previous one
+        return [(date_time, speed, segment or 0) for date_time, speed, segment in rows]
 
-    def get_total_km(self, run):
-        positions = Position.objects.filter(run=run)
-        length = len(positions)
+    def get_total_km(self, run, track):
         total = 0
         result_time = timedelta(seconds=0)
-        if length > 1:
-            for index, position in enumerate(positions):
-                if index == length - 1:
-                    break
-                start = (positions[index].latitude, positions[index].longitude)
-                finish = (positions[index + 1].latitude, positions[index + 1].longitude)
-                total += geodesic(start, finish).km
+        if len(track) > 1:
+            total = sum(segment for _, _, segment in track)
             run.distance = round(total, 3)
             # find max and min time
-            date_time_stats = positions.aggregate(
-                min_time=Min("date_time"), max_time=Max("date_time")
-            )
-            result_time = date_time_stats["max_time"] - date_time_stats["min_time"]
+            times = [date_time for date_time, _, _ in track if date_time is not None]
+            if times:
+                result_time = max(times) - min(times)
             run.run_time_seconds = round(result_time.total_seconds())
 
             # avarage speed (meters per seconds)
-            avg_speed = positions.aggregate(avg_speed=Avg("speed"))["avg_speed"]
-            run.speed = round(avg_speed, 2) if avg_speed is not None else 0
+            speeds = [speed for _, speed, _ in track if speed is not None]
+            run.speed = round(sum(speeds) / len(speeds), 2) if speeds else 0
         else:
             run.run_time_seconds = 0
             run.distance = 0
@@ -233,34 +535,224 @@ class StopRunView(APIView):
         run.save()
         return total, result_time
 
+    def save_splits(self, run, track):
+        """
+        Splits and best efforts are computed from the measured segments
+        of the track, without the rounding of the distance chain
+        which save_position keeps in every position.
+        """
+        points = get_track_points(track)
+
+        Split.objects.filter(run=run).delete()
+        BestEffort.objects.filter(run=run).delete()
+        Split.objects.bulk_create(
+            Split(run=run, km=km, seconds=seconds)
+            for km, seconds in enumerate(get_splits(points), start=1)
+        )
+        efforts = []
+        for effort in EffortChoices.values:
+            seconds = get_best_effort(points, effort)
+            if seconds is not None:
+                efforts.append(
+                    BestEffort(
+                        run=run, athlete=run.athlete, distance=effort, seconds=seconds
+                    )
+                )
+        BestEffort.objects.bulk_create(efforts)
+
     def check_2km_10min(self, distance, result_time_sec):
         ten_minutes = timedelta(minutes=10)
         return distance >= 2 and result_time_sec <= ten_minutes
 
 
-class AthleteInfoView(APIView):
+class RunSplitsView(APIView):
     """
-    GET or PUT request to see additional info about athlete
-    If AthleteInfo does not exist django will create it.
+    Kilometre splits and best efforts of the finished run
     """
 
     def get(self, request, id):
-        athlete, _ = AthleteInfo.objects.select_related("user_id").get_or_create(
-            user_id_id=id
+        run = get_object_or_404(Run, id=id)
+        data = {
+            "splits": SplitSerializer(run.splits.all(), many=True).data,
+            "best_efforts": BestEffortSerializer(
+                run.best_efforts.order_by("distance"), many=True
+            ).data,
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class PersonalBestsView(APIView):
+    """
+    Fastest 1 km, 5 km and 10 km of the athlete among all runs.
+    Every distance is one lookup in the (athlete, distance, seconds) index.
+    """
+
+    def get(self, request, id):
+        athlete = get_object_or_404(User, id=id)
+        bests = []
+        for effort in EffortChoices.values:
+            best = (
+                BestEffort.objects.filter(athlete=athlete, distance=effort)
+                .order_by("seconds")
+                .first()
+            )
+            if best:
+                bests.append(best)
+        serializer = BestEffortSerializer(bests, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class RunHistoryView(APIView):
+    """
+    History chart of the athlete from weekly or monthly rollups.
+    ?period=week|month (week by default)&from=<YYYY-MM-DD>&to=<YYYY-MM-DD>,
+    the last year by default.
+    """
+
+    read_from_replica = True
+
+    def get(self, request, id):
+        athlete = get_object_or_404(User, id=id)
+        params = request.query_params
+        try:
+            period = PeriodChoices(params.get("period", PeriodChoices.WEEK))
+            end = (
+                date.fromisoformat(params["to"])
+                if "to" in params
+                else timezone.localdate()
+            )
+            start = (
+                date.fromisoformat(params["from"])
+                if "from" in params
+                else end - timedelta(days=365)
+            )
+        except ValueError:
+            data = {
+                "detail": f"Please provide period from {PeriodChoices.values} "
+                "and dates as YYYY-MM-DD"
+            }
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+        history = RunRollup.objects.filter(
+            athlete=athlete, period=period, start__range=(start, end)
+        )
+        serializer = RunRollupSerializer(history, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class CoachDashboardView(APIView):
+    """
+    Every athlete of the coach with totals, recent finished runs,
+    challenges and the rating given to the coach in one call.
+    ?page=<n>&size=<athletes per page>
+    Pages are cached until a run of an athlete is finished
+    or the subscriptions of the coach change.
+    """
+
+    read_from_replica = True
+
+    def get(self, request, coach_id):
+        key = dashboard.cache_key(coach_id, request.query_params.urlencode())
+        data = cache.get(key)
+        count_cache("coach_dashboard", data is not None)
+        if data is not None:
+            return Response(data, status=status.HTTP_200_OK)
+
+        coach = get_object_or_404(
+            User.objects.annotate(
+                avg_rating=Cast("coach_stats__rating_sum", FloatField())
+                / NullIf("coach_stats__rating_count", 0)
+            ),
+            pk=coach_id,
+        )
+        if not coach.is_staff:
+            return ORJSONResponse(
+                {"info": "Статистику можно получить только по тренеру"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        paginator = CoachDashboardPagination()
+        athletes = paginator.paginate_queryset(
+            dashboard.get_athletes(coach), request, view=self
         )
         data = {
-            "goals": athlete.goals,
-            "weight": athlete.weight,
-            "user_id": athlete.user_id.id,
+            "coach": UserSerializer(
+                coach, fields=["id", "username", "last_name", "first_name", "rating"]
+            ).data,
+            "count": paginator.page.paginator.count,
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
+            "results": DashboardAthleteSerializer(athletes, many=True).data,
         }
-        return JsonResponse(data, status=status.HTTP_200_OK)
+        cache.set(key, data, settings.COACH_DASHBOARD_CACHE_SECONDS)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class HeatmapView(APIView):
+    """
+    Number of positions per cell of the heatmap.
+    ?zoom=<one of HEATMAP_ZOOM_LEVELS>&bbox=<min_lon>,<min_lat>,<max_lon>,<max_lat>
+    Cells are x and y of Web Mercator tiles of the zoom.
+    """
+
+    read_from_replica = True
+
+    def get(self, request):
+        try:
+            zoom = int(request.query_params.get("zoom"))
+            bbox = [float(value) for value in request.query_params["bbox"].split(",")]
+            min_longitude, min_latitude, max_longitude, max_latitude = bbox
+            assert zoom in settings.HEATMAP_ZOOM_LEVELS
+            assert min_longitude <= max_longitude and min_latitude <= max_latitude
+        except (KeyError, TypeError, ValueError, AssertionError):
+            data = {
+                "detail": f"Please provide zoom from {settings.HEATMAP_ZOOM_LEVELS} "
+                "and bbox=min_lon,min_lat,max_lon,max_lat"
+            }
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+        cells = heatmap.get_cells(zoom, *bbox)
+        if cells is None:
+            data = {"detail": "Bounding box is too big for this zoom"}
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"zoom": zoom, "cells": cells}, status=status.HTTP_200_OK)
+
+
+class AthleteInfoView(APIView):
+    """
+    GET or PUT request to see additional info about athlete
+    GET never writes: an athlete without AthleteInfo gets the defaults,
+    the row is created by the first PUT.
+    Answers are cached per athlete, PUT replaces the cached answer.
+    """
+
+    read_from_replica = True
+
+    @staticmethod
+    def cache_key(id):
+        return f"athlete_info:{id}"
+
+    def get(self, request, id):
+        data = cache.get(self.cache_key(id))
+        count_cache("athlete_info", data is not None)
+        if data is None:
+            data = (
+                AthleteInfo.objects.filter(user_id_id=id)
+                .values("goals", "weight", "user_id")
+                .first()
+            )
+            if data is None:
+                athlete = get_object_or_404(User, id=id)
+                data = {"goals": "", "weight": None, "user_id": athlete.id}
+            cache.set(self.cache_key(id), data, settings.ATHLETE_INFO_CACHE_SECONDS)
+        return ORJSONResponse(data, status=status.HTTP_200_OK)
 
     def put(self, request, id):
         goals = request.data.get("goals")
         weight = request.data.get("weight")
 
         if not goals or not weight:
-            return JsonResponse(
+            return ORJSONResponse(
                 {"detail": "Please provide goals and weight"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
@@ -269,7 +761,7 @@ class AthleteInfoView(APIView):
             weight = int(weight)
             assert 0 < weight < 900
         except (ValueError, AssertionError):
-            return JsonResponse(
+            return ORJSONResponse(
                 {"detail": "weight should be greater than 0 and smaller than 900"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
@@ -279,10 +771,9 @@ class AthleteInfoView(APIView):
             defaults={"goals": goals, "weight": weight},
         )
 
-        return JsonResponse(
-            {"goals": athlete.goals, "weight": athlete.weight, "user_id": id},
-            status=status.HTTP_201_CREATED,
-        )
+        data = {"goals": athlete.goals, "weight": athlete.weight, "user_id": id}
+        cache.set(self.cache_key(id), data, settings.ATHLETE_INFO_CACHE_SECONDS)
+        return ORJSONResponse(data, status=status.HTTP_201_CREATED)
 
 
 class ChallengesViewSet(viewsets.ReadOnlyModelViewSet):
@@ -292,6 +783,7 @@ class ChallengesViewSet(viewsets.ReadOnlyModelViewSet):
     """
 
     serializer_class = ChallengesSerializer
+    read_from_replica = True
 
     def get_queryset(self):
         queryset = Challenge.objects.all()
@@ -301,7 +793,7 @@ class ChallengesViewSet(viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-class PositionViewSet(viewsets.ModelViewSet):
+class PositionViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing and editing position instances.
     There is validation in the serializer.
@@ -325,58 +817,185 @@ class PositionViewSet(viewsets.ModelViewSet):
             queryset = self.queryset
         return queryset
 
-    def perform_create(self, serializer):
-        # Before save we find last position
-        last_position = (
-            Position.objects.filter(run=serializer.validated_data["run"])
-            .order_by("-date_time")
-            .first()
+    def list(self, request, *args, **kwargs):
+        if "resolution" in request.query_params:
+            return self.list_buckets(request)
+        return super().list(request, *args, **kwargs)
+
+    def list_buckets(self, request):
+        """
+        ?run=<id>&resolution=<seconds> returns one row per time bucket:
+        average speed, last cumulative distance and centroid.
+        Grouping happens in the database, positions are never loaded.
+        """
+        try:
+            run_id = int(request.query_params.get("run"))
+            resolution = int(request.query_params.get("resolution"))
+            assert resolution > 0
+        except (TypeError, ValueError, AssertionError):
+            data = {"detail": "Please provide run and positive resolution in seconds"}
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+        buckets = (
+            Position.objects.filter(run=run_id, date_time__isnull=False)
+            .annotate(bucket=Floor(Epoch("date_time") / resolution))
+            .values("bucket")
+            .annotate(
+                points=Count("id"),
+                speed=Avg("speed"),
+                distance=Max("distance"),
+                latitude=Avg("latitude"),
+                longitude=Avg("longitude"),
+            )
+            .order_by("bucket")
         )
+        data = [
+            {
+                "date_time": datetime.fromtimestamp(
+                    bucket.pop("bucket") * resolution, tz=dt_timezone.utc
+                ).strftime("%Y-%m-%dT%H:%M:%S.%f"),
+                **bucket,
+            }
+            for bucket in buckets
+        ]
+        return Response(data, status=status.HTTP_200_OK)
 
-        instance = serializer.save()
+    def perform_create(self, serializer):
+        if settings.POSITION_WRITE_BEHIND:
+            return self.perform_buffered_create(serializer)
+        instance, created = save_position(Position(**serializer.validated_data))
+        serializer.instance = instance
+        if not created:
+            # a retried upload gets the stored position back
+            return
+        POSITIONS_INGESTED.labels("positions").inc()
         current_position = (instance.latitude, instance.longitude)
         athlete = instance.run.athlete
         # это все бы надо в celery!
         self.check_collectible_awards(instance, current_position, athlete)
-        self.check_speed(instance, last_position)
+        get_broker().publish(instance.run_id, position_message(instance))
+
+    def perform_buffered_create(self, serializer):
+        """
+        The position is written later with other positions of the run,
+        so the response has no id yet.
+        """
+        instance, created = get_position_buffer().add(
+            Position(**serializer.validated_data)
+        )
+        serializer.instance = instance
+        if not created:
+            return
+        POSITIONS_INGESTED.labels("positions").inc()
+        if settings.COLLECTIBLES_PER_POSITION:
+            current_position = (instance.latitude, instance.longitude)
+            athlete = instance.run.athlete
+            self.check_collectible_awards(instance, current_position, athlete)
 
     def check_collectible_awards(self, instance, current_position, athlete):
-        # radius of search is 0.1 km. Approx 0.001 degree
-        delta = 0.001
-        lat, lon = instance.latitude, instance.longitude
-
-        # find collectible items that are close to the position of the runner
-        collectible_items = CollectibleItem.objects.filter(
-            latitude__range=(lat - delta, lat + delta),
-            longitude__range=(lon - delta, lon + delta),
+        if settings.COLLECTIBLES_PER_POSITION:
+            award_collectible_items(*current_position, athlete)
+
+
+# Strong references to scheduled side effects, asyncio keeps only weak ones
+_side_effects = set()
+
+
+def schedule_side_effect(func, *args):
+    """
+    Runs blocking func in a worker thread without delaying the response.
+    The task gets a fresh context, so it does not reuse the thread
+    of the request that has already finished.
+    """
+    task = asyncio.get_running_loop().create_task(
+        sync_to_async(func)(*args), context=contextvars.Context()
+    )
+    _side_effects.add(task)
+    task.add_done_callback(_side_effects.discard)
+    task.add_done_callback(partial(log_side_effect_error, func))
+    return task
+
+
+def log_side_effect_error(func, task):
+    # nobody awaits the task, its exception would be lost
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            "Side effect %s failed", func.__qualname__, exc_info=task.exception()
         )
 
-        for item in collectible_items:
-            if validate_latitude(item.latitude) and validate_longitude(item.longitude):
-                desirable = (item.latitude, item.longitude)
-                difference = geodesic(current_position, desirable).km
-                if difference < 0.1:
-                    item.users.add(athlete)
-
-    def check_speed(self, instance, last_position_obj):
-        if not last_position_obj:
-            instance.speed = 0
-            instance.distance = 0
-            instance.save()
-            return 0
-        # calc speed v = s / t
-        # s – distance, а t – time
-        # our task is to get in meters per seconds
-        last_position = (last_position_obj.latitude, last_position_obj.longitude)
-        current_position = (instance.latitude, instance.longitude)
-        distance_m = geodesic(current_position, last_position).meters
-        # time delta
-        delta_t = (instance.date_time - last_position_obj.date_time).total_seconds()
-        # speed
-        speed = distance_m / delta_t if delta_t > 0 else 0
-        instance.speed = round(speed, 2)
-        instance.distance = last_position_obj.distance + round(distance_m / 1000, 2)
-        instance.save(update_fields=["distance", "speed"])
+
+async def wait_side_effects():
+    """
+    Waits for all scheduled side effects. Used by tests and benchmarks.
+    """
+    return await asyncio.gather(*_side_effects, return_exceptions=True)
+
+
+@require_POST
+async def ingest_position(request):
+    """
+    Async variant of PositionViewSet.create for the ASGI application.
+    The position is saved by save_position in a worker thread,
+    collectible awards are scheduled without blocking the response.
+    """
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        data = {"detail": "JSON parse error"}
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = AsyncPositionSerializer(data=payload)
+    if not await serializer.ais_valid():
+        return ORJSONResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # the same dedup, late fix chaining and run lock as PositionViewSet
+    instance, created = await sync_to_async(save_position)(
+        Position(**serializer.validated_data)
+    )
+    serializer.instance = instance
+    if not created:
+        # a retried upload gets the stored position back
+        return ORJSONResponse(serializer.data, status=status.HTTP_201_CREATED)
+    POSITIONS_INGESTED.labels("ingest").inc()
+    # publish is thread-safe, listeners get the point from their own loops
+    get_broker().publish(instance.run_id, position_message(instance))
+    if settings.COLLECTIBLES_PER_POSITION:
+        schedule_side_effect(
+            award_collectible_items,
+            instance.latitude,
+            instance.longitude,
+            serializer.run.athlete,
+        )
+    return ORJSONResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@require_GET
+async def live_positions(request, id):
+    """
+    Server-Sent Events stream of new positions of the run.
+    The client resumes with Last-Event-ID header or ?last_id=<position id>
+    and receives only points after it. The stream ends when the run is finished.
+    """
+    if not await Run.objects.filter(id=id).aexists():
+        return ORJSONResponse(
+            {"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND
+        )
+    try:
+        last_id = int(
+            request.headers.get("Last-Event-ID") or request.GET.get("last_id") or 0
+        )
+    except ValueError:
+        data = {"detail": "last_id should be a position id"}
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+    async def events():
+        async for message in get_broker().listen(id, last_id):
+            yield format_event(message)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 class CollectibleItemViewSet(viewsets.ReadOnlyModelViewSet):
@@ -386,6 +1005,41 @@ class CollectibleItemViewSet(viewsets.ReadOnlyModelViewSet):
 
     serializer_class = CollectibleItemSerializer
     queryset = CollectibleItem.objects.all()
+    read_from_replica = True
+
+    @action(detail=False)
+    def nearby(self, request):
+        """
+        Items within ?radius= km (1 by default) of ?lat=&lon=, closest first.
+        Items already collected by ?athlete= are skipped.
+        """
+        params = request.query_params
+        try:
+            latitude = float(params["lat"])
+            longitude = float(params["lon"])
+            radius = float(params.get("radius", 1))
+            limit = int(params.get("limit", 20))
+            assert -90 <= latitude <= 90 and -180 <= longitude <= 180
+            assert 0 < radius <= settings.NEARBY_MAX_RADIUS_KM
+            assert 0 < limit <= settings.NEARBY_MAX_LIMIT
+        except (KeyError, TypeError, ValueError, AssertionError):
+            data = {
+                "detail": "Please provide lat, lon, "
+                f"radius up to {settings.NEARBY_MAX_RADIUS_KM} km "
+                f"and limit up to {settings.NEARBY_MAX_LIMIT}"
+            }
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+        exclude = set()
+        athlete_id = params.get("athlete")
+        if athlete_id:
+            exclude = set(
+                CollectibleItem.users.through.objects.filter(
+                    user_id=athlete_id
+                ).values_list("collectibleitem_id", flat=True)
+            )
+        items = collectible_index.nearby(latitude, longitude, radius, limit, exclude)
+        return Response(items, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
@@ -396,7 +1050,10 @@ def upload_collectible_items(request):
     file = request.FILES.get("file")
     if not file:
         data = {"error": "Please provide xlsx file"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+    # openpyxl is heavy and needed only here, it is not loaded at startup
+    from openpyxl import load_workbook
+
     # Проверка и чтение файла
     workbook = load_workbook(filename=file, data_only=True)
     sheet = workbook.active
@@ -420,14 +1077,17 @@ def upload_collectible_items(request):
         serializer = CollectibleItemSerializer(data=item_data)
         if serializer.is_valid():
             serializer.save()
+            XLSX_ROWS.labels("imported").inc()
         else:
+            XLSX_ROWS.labels("rejected").inc()
             # [] for errors inside this row
             error_colums = []
             for field in serializer.fields:
                 error_colums.append(item_data[field])
             errors.append(error_colums)
 
-    return JsonResponse(errors, status=status.HTTP_200_OK, safe=False)
+    collectible_index.invalidate()
+    return ORJSONResponse(errors, status=status.HTTP_200_OK, safe=False)
 
 
 @api_view(["POST"])
@@ -435,31 +1095,34 @@ def subscribe_to_coach(request, id):
     coach = get_object_or_404(User, pk=id)
     if not coach.is_staff:
         data = {"info": "Можно подписаться только на тренера"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     athlete_id = request.data.get("athlete")
     try:
         athlete = User.objects.get(pk=athlete_id)
     except User.DoesNotExist:
         data = {"info": f"Атлет с ID {athlete_id} не найден"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     if athlete.is_staff:
         data = {"info": "На тренера могут подписаться только бегуны"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
-    if Subscribe.objects.filter(coach=coach, athlete=athlete).exists():
+    try:
+        # the unique constraint rejects a second subscription
+        with transaction.atomic():
+            subscription = Subscribe.objects.create(coach=coach, athlete=athlete)
+    except IntegrityError:
         data = {"info": "Подписку можно оформить только 1 раз"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
-
-    subscription = Subscribe.objects.create(coach=coach, athlete=athlete)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     data = {"Подписка": subscription.id}
 
-    return JsonResponse(data, status=status.HTTP_200_OK)
+    return ORJSONResponse(data, status=status.HTTP_200_OK)
 
 
 class ChallengesListView(APIView):
+    read_from_replica = True
 
     def get(self, request):
         challenges_list = list(Challenge.objects.select_related("athlete").all())
@@ -483,47 +1146,56 @@ def rate_coach(request, coach_id):
     coach = get_object_or_404(User, pk=coach_id)
     if not coach.is_staff:
         data = {"info": "Можно дать оценку только тренеру"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     athlete_id = request.data.get("athlete")
     try:
         athlete = User.objects.get(pk=athlete_id)
     except User.DoesNotExist:
         data = {"info": f"Атлет с ID {athlete_id} не найден"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     try:
         rating = int(request.data.get("rating"))
     except:
         data = {"info": "Рейтинг не является числовым значением"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     if rating > 5 or rating < 1:
         data = {"info": f"Рейтинг {rating} должен быть от 1 до 5"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
     if athlete.is_staff:
         data = {"info": "Дать оценку тренерам могут только бегуны"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
-
-    if not Subscribe.objects.filter(coach=coach, athlete=athlete).exists():
-        data = {"info": "Дать оценку тренерам может атлет, который на него подписан"}
-        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
 
-    subscription = Subscribe.objects.get(coach=coach, athlete=athlete)
-    subscription.rating = rating
-    subscription.save()
+    with transaction.atomic():
+        subscription = (
+            Subscribe.objects.select_for_update()
+            .filter(coach=coach, athlete=athlete)
+            .values("id", "rating")
+            .first()
+        )
+        if not subscription:
+            data = {
+                "info": "Дать оценку тренерам может атлет, который на него подписан"
+            }
+            return ORJSONResponse(data, status=status.HTTP_400_BAD_REQUEST)
+        Subscribe.objects.filter(id=subscription["id"]).update(rating=rating)
+        change_rating(coach.id, subscription["rating"], rating)
+    dashboard.invalidate(coach.id)
 
     data = {"Новый рейтинг": rating}
 
-    return JsonResponse(data, status=status.HTTP_200_OK)
+    return ORJSONResponse(data, status=status.HTTP_200_OK)
 
 
+@read_from_replica
 @api_view(["GET"])
 def analytics_for_coach(request, coach_id):
     coach = get_object_or_404(User, pk=coach_id)
     if not coach.is_staff:
-        return JsonResponse(
+        return ORJSONResponse(
             {"info": "Статистику можно получить только по тренеру"},
             status=status.HTTP_400_BAD_REQUEST,
         )
@@ -540,7 +1212,7 @@ def analytics_for_coach(request, coach_id):
     )
 
     if not runs:
-        return JsonResponse(
+        return ORJSONResponse(
             {"info": "У этого тренера пока нет забегов у атлетов"},
             status=status.HTTP_200_OK,
         )
@@ -558,4 +1230,4 @@ def analytics_for_coach(request, coach_id):
         "speed_avg_value": round(speed_avg["avg_speed"] or 0, 2),
     }
 
-    return JsonResponse(data, status=status.HTTP_200_OK)
+    return ORJSONResponse(data, status=status.HTTP_200_OK)
@@ -0,0 +1,54 @@
+"""
+Warm-up of a fresh worker.
+Serverless instances start on a user request, warm_up moves the work
+of the first request to the start of the instance.
+"""
+
+import importlib
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+from .serializers import ValuesSerializer
+
+# imported lazily by the hot views, a warm instance should already have them.
+# openpyxl stays lazy, only the rare xlsx upload pays for it.
+PRELOADED_MODULES = ["geopy.distance"]
+
+
+def warm_up():
+    """
+    Returns seconds spent on every step.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    resolver = get_resolver()
+    # builds the lookup tables used by resolve() and reverse()
+    resolver.reverse_dict
+    timings["urls"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from .urls import router
+    from .views import ValuesListMixin
+
+    for _, viewset, _ in router.registry:
+        serializer_class = viewset.serializer_class
+        serializer_class().fields
+        if issubclass(viewset, ValuesListMixin):
+            ValuesSerializer.for_class(serializer_class)
+    timings["serializers"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # databases the router can choose, see ReplicaRouter
+    for alias in ["default", *settings.DATABASE_REPLICAS]:
+        connections[alias].ensure_connection()
+    timings["databases"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for module in PRELOADED_MODULES:
+        importlib.import_module(module)
+    timings["modules"] = time.perf_counter() - started
+    return timings
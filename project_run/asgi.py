@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_run.settings')
 
 application = get_asgi_application()
+
+if os.environ.get('DJANGO_WARM_UP'):
+    # pay for the first request at the start of the instance
+    from app_run.warmup import warm_up
+
+    warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,10 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it measures the whole request
+    "app_run.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "app_run.middleware.ProfilerMiddleware",
+    "app_run.middleware.ReplicaRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -73,6 +78,14 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "project_run.wsgi.application"
 
+# Read replicas
+# Aliases from DATABASES. Safe requests to views marked with read_from_replica
+# read from them, writes and reads right after a write go to default.
+DATABASE_ROUTERS = ["app_run.db_routers.ReplicaRouter"]
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 5
+REPLICA_MAX_LAG_SECONDS = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -120,3 +133,95 @@ COMPANY_INFORMATION = {
     "slogan": "Бегаем в любую погоду! От -30 до +30!",
     "contacts": "Город Задунайск, улица 30 Лет СССР, дом 30",
 }
+
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "app_run.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "app_run.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+}
+
+# StopRunView measures the segments of the track with LAG() and haversine
+# in the database instead of loading coordinates and measuring geodesic distances.
+# Haversine uses a sphere, results differ from geodesic by up to 0.5%.
+TRACK_LENGTH_IN_DATABASE = False
+
+# Number of cached geodesic distances between grid points (4 decimals)
+GEODESIC_CACHE_SIZE = 65536
+
+# Cached answers (athlete info, heatmap, counts, coach dashboards) and their
+# invalidation must be shared by all workers and Lambda instances,
+# a per-process cache would let a write refresh only its own process.
+# Reads fill the cache on a miss, so it is not kept in the database:
+# that would turn every missed GET into a write on the primary.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/0"),
+    }
+}
+
+# Heatmap of positions: zoom levels of pre-aggregated cells,
+# the biggest answer of the tile endpoint and its cache lifetime
+HEATMAP_ZOOM_LEVELS = [8, 10, 12, 14, 16]
+HEATMAP_MAX_CELLS = 10000
+HEATMAP_CACHE_SECONDS = 300
+
+# Counts of paginated user lists are cached for a short time,
+# on PostgreSQL counts above the threshold come from the planner (None - never)
+PAGINATION_COUNT_CACHE_SECONDS = 30
+PAGINATION_ESTIMATE_COUNT_OVER = None
+
+# Bearer token required by /api/metrics/, without it the endpoint
+# answers only with DEBUG on.
+# Set PROMETHEUS_MULTIPROC_DIR in the environment of multi-worker servers.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# On-demand profiling of requests of staff users (?profile=1 or ?profile=sample,
+# or the X-Profile header), the last PROFILER_KEEP profiles are kept
+PROFILER_DIR = BASE_DIR / "profiles"
+PROFILER_QUERY_PARAM = "profile"
+PROFILER_SAMPLE_INTERVAL = 0.001
+PROFILER_KEEP = 50
+
+# lifetime of cached athlete info answers, PUT refreshes them
+ATHLETE_INFO_CACHE_SECONDS = 300
+
+# coach dashboard: finished runs shown per athlete and lifetime of cached pages,
+# finishing a run of an athlete invalidates the pages of the coach
+COACH_DASHBOARD_RECENT_RUNS = 5
+COACH_DASHBOARD_CACHE_SECONDS = 300
+
+# limits of the nearby collectible items endpoint and the age of the index
+# of a worker, after which edits of items in other workers are picked up
+NEARBY_MAX_RADIUS_KM = 50
+NEARBY_MAX_LIMIT = 100
+NEARBY_INDEX_MAX_AGE_SECONDS = 60
+
+# Collectible items are awarded for every accepted position (one query each)
+# and by a sweep of the whole track when the run is stopped,
+# which also catches items passed between two sparse fixes
+COLLECTIBLES_PER_POSITION = True
+COLLECTIBLES_SWEEP_AT_STOP = True
+
+# Live run tracking over Server-Sent Events
+# DatabaseBroker works with several workers, InMemoryBroker only inside one process
+LIVE_TRACKING = {
+    "BACKEND": "app_run.live.InMemoryBroker",
+    "OPTIONS": {"keepalive": 15},
+}
+
+# Write-behind of positions: accepted positions are buffered per run
+# and written with bulk_create after max_size positions or max_age seconds.
+# Buffers are per process, see app_run.buffer before enabling it
+# with several workers or on serverless instances.
+POSITION_WRITE_BEHIND = False
+POSITION_BUFFER = {
+    "BACKEND": "app_run.buffer.InMemoryPositionBuffer",
+    "OPTIONS": {"max_size": 200, "max_age": 2.0},
+}